@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+from scheduler import PollScheduler
+from resilience import CircuitBreaker, RetryPolicy
+
+DEFAULT_ACCOUNT = "default"     # key of the account set in the plugin preferences
+
+
+################################################################################
+class CloudAccount:
+    """
+    One MyQ login and everything that is polled through it: the session, its own poll schedule and request
+    budget, and the refresh in flight for it.  Accounts are independent, so a slow or failing account doesn't
+    hold up the others.
+
+    The account from the plugin preferences has the key DEFAULT_ACCOUNT.  Each MyQ Account device with its own
+    login is an extra account, keyed by the device id as a string.
+
+    Every cloud call for the account goes through its RetryPolicy, and on_breaker_change(account, state) is
+    called when its circuit breaker opens or closes.  The account's metrics are its session's, shared with the
+    policy, so each account's figures are its own.
+
+    A refresh either sweeps the whole account or fetches only the MyQ devices in refresh_targets.  Until its fetch
+    starts, a refresh in flight can take on more devices, so requests close together share one fetch.
+    """
+
+    def __init__(self, key, name, session, idle_interval, interval_override=None, on_breaker_change=None):
+        self.key = key
+        self.name = name
+        self.session = session
+        self.metrics = session.metrics
+        self.interval_override = interval_override      # seconds, or None to follow the plugin's status frequency
+        self.scheduler = PollScheduler(interval_override or idle_interval)
+        self.breaker = CircuitBreaker(lambda state: on_breaker_change(self, state) if on_breaker_change else None)
+        self.policy = RetryPolicy(self.breaker, self.reset_session, self.metrics)
+        self.status = "starting"
+        self.serials = set()        # MyQ devices seen in this account's last successful poll
+        self.refresh_task = None
+        self.refresh_targets = None     # MyQ serials the refresh in flight is for, None for the whole account
+        self.refresh_started = False    # the refresh in flight has started fetching, too late to add devices
+
+    def set_idle_interval(self, idle_interval):
+        self.scheduler.set_idle_interval(self.interval_override or idle_interval)
+
+    async def reset_session(self):
+        await self.session.reset()
+
+    def refresh_in_flight(self):
+        return self.refresh_task is not None and not self.refresh_task.done()
+
+    def refresh_covers(self, serials):
+        # True if the refresh in flight fetches these devices (None for the whole account)
+        if not self.refresh_in_flight():
+            return False
+        return self.refresh_targets is None or (serials is not None and serials <= self.refresh_targets)
+
+    def join_refresh(self, serials):
+        # Add devices to the refresh in flight if it hasn't fetched yet.  Returns True if they were added.
+        if not self.refresh_in_flight() or self.refresh_started:
+            return False
+        if serials is None:
+            self.refresh_targets = None
+        elif self.refresh_targets is not None:
+            self.refresh_targets = self.refresh_targets | serials
+        return True
@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+import asyncio
+import logging
+
+from resilience import cancel, cancel_requested
+
+COMMAND_OPEN = "open"
+COMMAND_CLOSE = "close"
+COMMAND_ON = "on"
+COMMAND_OFF = "off"
+
+CONFIRM_TIMEOUT = 150.0     # pymyq waits up to 60 seconds for the cloud to report, then 60 more for the new state
+
+
+################################################################################
+class CommandDispatcher:
+    """
+    Runs device commands concurrently, one worker per MyQ device.
+
+    Commands for different devices run in parallel over the shared session.  For a single device, commands
+    run in order.  A command that arrives while another is in flight waits in a one-deep slot.  A newer command
+    replaces whatever is waiting (superseded), and a repeat of the in-flight or waiting command is dropped
+    (duplicate).  When a device's command finishes, on_complete(serial, command, result) is called for that device.
+
+    All methods must be called on the plugin event loop.
+    """
+
+    def __init__(self, execute, on_complete):
+        self.logger = logging.getLogger("Plugin.Commands.Dispatcher")
+        self.execute = execute          # async execute(serial, command) -> True (accepted), None (not sent)
+        self.on_complete = on_complete
+        self.active = {}                # serial -> command in flight
+        self.pending = {}               # serial -> next command to send
+        self.workers = {}               # serial -> worker task
+        self.duplicates = 0
+        self.superseded = 0
+
+    def submit(self, serial, command):
+        if serial not in self.workers:
+            self.pending[serial] = command
+            self.workers[serial] = asyncio.ensure_future(self._worker(serial))
+            return
+
+        if command == self.active.get(serial):
+            # the device is already heading where this command wants it, anything waiting would undo that
+            if self.pending.pop(serial, None):
+                self.superseded += 1
+            self.duplicates += 1
+            self.logger.debug("submit: dropping duplicate '%s' for %s, already in progress", command, serial)
+        elif command == self.pending.get(serial):
+            self.duplicates += 1
+            self.logger.debug("submit: dropping duplicate '%s' for %s, already queued", command, serial)
+        else:
+            if serial in self.pending:
+                self.superseded += 1
+                self.logger.debug("submit: '%s' supersedes queued '%s' for %s", command, self.pending[serial], serial)
+            self.pending[serial] = command
+
+    def busy(self, serial):
+        return serial in self.workers
+
+    async def cancel_all(self):
+        self.pending.clear()
+        tasks = list(self.workers.values())
+        for task in tasks:
+            cancel(task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _worker(self, serial):
+        try:
+            while serial in self.pending:
+                command = self.pending.pop(serial)
+                self.active[serial] = command
+                try:
+                    result = await self.execute(serial, command)
+                except asyncio.CancelledError:
+                    if cancel_requested():
+                        raise
+                    self.logger.error(f"Error sending '{command}' to {serial}: cancelled")
+                    result = None
+                except Exception as err:
+                    self.logger.error(f"Error sending '{command}' to {serial}: {err!r}")
+                    result = None
+                finally:
+                    del self.active[serial]
+                try:
+                    self.on_complete(serial, command, result)
+                except Exception as err:
+                    self.logger.error(f"Error completing '{command}' for {serial}: {err!r}")
+        finally:
+            del self.workers[serial]
+
+
+################################################################################
+class PendingCommand:
+    __slots__ = ("serial", "command", "last_update", "started", "task")
+
+    def __init__(self, serial, command, last_update):
+        self.serial = serial
+        self.command = command
+        self.last_update = last_update      # the device's cloud timestamp when the command was sent
+        self.started = time.time()
+        self.task = None
+
+
+################################################################################
+class ConfirmationTracker:
+    """
+    Commands the cloud has accepted but not yet confirmed, at most one per MyQ device.
+
+    While a command is pending, the Indigo device shows the state it is heading for.  Cloud updates that carry
+    nothing newer than the device's timestamp when the command was sent are held back, so a poll can't flip the
+    device back before the cloud has caught up.  Each command's confirmation runs as its own task, so the
+    device's command worker is free as soon as the cloud accepts the command.
+
+    A device whose command wasn't confirmed keeps an error until the cloud reports something newer for it, or
+    the next command for it is accepted.
+
+    pymyq's own confirmation task for each device's last command is kept too.  pymyq makes the next command for
+    the device wait for it, so settled() lets the plugin wait for it first, without a timeout that would cancel it.
+
+    All methods must be called on the plugin event loop.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("Plugin.Commands.Confirmation")
+        self.pending = {}               # serial -> PendingCommand
+        self.errors = {}                # serial -> device timestamp when its last command failed
+        self.wait_tasks = {}            # serial -> pymyq's confirmation task for the device's last command
+        self.confirmed = 0
+        self.failed = 0
+
+    def __contains__(self, serial):
+        return serial in self.pending
+
+    def start(self, serial, command, last_update, wait_task, confirm):
+        # confirm(pending) is a coroutine function that returns True once the cloud confirms the command
+        previous = self.pending.get(serial)
+        if previous and previous.task:
+            cancel(previous.task)
+        self.errors.pop(serial, None)
+        if isinstance(wait_task, asyncio.Future):
+            self.wait_tasks[serial] = wait_task
+        pending = self.pending[serial] = PendingCommand(serial, command, last_update)
+        pending.task = asyncio.ensure_future(confirm(pending))
+        return pending
+
+    async def settled(self, serial):
+        # Wait for pymyq's confirmation task from the device's last command.  Never cancels it, or raises its errors.
+        wait_task = self.wait_tasks.get(serial)
+        if wait_task and not wait_task.done():
+            self.logger.debug("settled: waiting for the last command for %s to finish", serial)
+            await asyncio.wait({wait_task})
+        if self.wait_tasks.get(serial) is wait_task:
+            self.wait_tasks.pop(serial, None)
+
+    def fail(self, serial, device_json):
+        self.errors[serial] = device_json.get("state", {}).get("last_update")
+
+    def error_cleared(self, serial, device_json):
+        # True, once, when a device with a failed command gets a newer cloud update
+        if serial not in self.errors or device_json.get("state", {}).get("last_update") == self.errors[serial]:
+            return False
+        del self.errors[serial]
+        return True
+
+    def holding(self, serial, device_json):
+        # True if this cloud update is older than the pending command and shouldn't overwrite its state
+        pending = self.pending.get(serial)
+        return pending is not None and device_json.get("state", {}).get("last_update") == pending.last_update
+
+    def finish(self, pending, confirmed):
+        # confirmed is None if the confirmation was abandoned, superseded by a newer command or shut down
+        if self.pending.get(pending.serial) is pending:
+            del self.pending[pending.serial]
+        if confirmed:
+            self.confirmed += 1
+        elif confirmed is not None:
+            self.failed += 1
+        self.logger.debug("finish: '%s' for %s %s after %.1f seconds", pending.command, pending.serial,
+                          {True: "confirmed", False: "not confirmed", None: "abandoned"}[confirmed],
+                          time.time() - pending.started)
+
+    async def cancel_all(self):
+        tasks = [pending.task for pending in self.pending.values() if pending.task]
+        tasks += [wait_task for wait_task in self.wait_tasks.values() if not wait_task.done()]
+        self.pending.clear()
+        self.wait_tasks.clear()
+        for task in tasks:
+            cancel(task)
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+import logging
+import threading
+
+PRECEDENCE_SENSOR = "sensor"    # the linked sensor decides open or closed, the cloud only adds opening/closing
+PRECEDENCE_CLOUD = "cloud"      # the cloud decides, the sensor is only checked against it
+PRECEDENCE_LATEST = "latest"    # whichever changed most recently
+
+DEFAULT_DEBOUNCE = 2.0          # seconds a sensor has to hold a new value before it counts
+
+DOOR_OPEN = "open"
+DOOR_CLOSED = "closed"
+DOOR_UNKNOWN = "unknown"
+DOOR_MOVING = ("opening", "closing", "transition", "autoreverse")
+
+
+################################################################################
+class FusedDoor:
+    __slots__ = ("devId", "precedence", "debounce", "cloud_state", "cloud_changed", "sensor_raw", "sensor_open",
+                 "sensor_changed", "token")
+
+    def __init__(self, devId, precedence, debounce, sensor_open):
+        self.devId = devId
+        self.precedence = precedence
+        self.debounce = debounce
+        self.cloud_state = None         # door_state from the cloud
+        self.cloud_changed = 0.0
+        self.sensor_raw = sensor_open   # the sensor as last reported, flaps included
+        self.sensor_open = sensor_open  # the sensor once debounced, None if not known
+        self.sensor_changed = time.time()
+        self.token = 0                  # bumped to cancel a pending debounce timer
+
+    def sensor_wins(self):
+        if self.sensor_open is None:
+            return False
+        if self.precedence == PRECEDENCE_SENSOR or self.cloud_state in (None, DOOR_UNKNOWN):
+            return True
+        if self.precedence == PRECEDENCE_LATEST:
+            return self.sensor_changed >= self.cloud_changed
+        return False
+
+    def states(self):
+        if not self.sensor_wins():
+            return {"doorStatus": self.cloud_state or DOOR_UNKNOWN, "onOffState": self.cloud_state == DOOR_CLOSED}
+        # the sensor can't see the door moving, so a cloud opening/closing stands until the sensor changes
+        if self.cloud_state in DOOR_MOVING and self.cloud_changed >= self.sensor_changed:
+            status = self.cloud_state
+        else:
+            status = DOOR_OPEN if self.sensor_open else DOOR_CLOSED
+        # closed is True (Locked)
+        return {"doorStatus": status, "onOffState": not self.sensor_open}
+
+    def mismatch(self):
+        # True if the debounced sensor and a settled cloud state disagree
+        if self.sensor_open is None or self.cloud_state in (None, DOOR_UNKNOWN) or self.cloud_state in DOOR_MOVING:
+            return False
+        return (self.cloud_state == DOOR_CLOSED) == self.sensor_open
+
+
+################################################################################
+class DoorFusion:
+    """
+    Door state for openers with a linked sensor, fused from the sensor and the cloud's door_state.
+
+    Sensor changes are debounced: a new value has to hold for the opener's debounce time before it counts, and
+    each change restarts the wait, so a chattering sensor settles into one state change, or none if it ends where
+    it started.  Which source wins is set per opener, see PRECEDENCE_*.  When the sensor wins, the opener doesn't
+    need fast cloud polls to see its door settle.
+
+    on_change(devId) is called when a debounced sensor change may change an opener's states.  It is always called
+    from a call_later() callback, a zero debounce included, so it runs on whatever thread call_later() uses.
+    Methods can be called from any thread, and call_later(delay, callback) must be thread-safe.
+    """
+
+    def __init__(self, on_change, call_later):
+        self.logger = logging.getLogger("Plugin.Sensors.Fusion")
+        self.on_change = on_change
+        self.call_later = call_later
+        self.lock = threading.Lock()
+        self.doors = {}                 # opener device id -> FusedDoor
+        self.sensor_events = 0
+        self.sensor_changes = 0         # debounced changes that counted
+
+    def __contains__(self, devId):
+        return devId in self.doors
+
+    def configure(self, devId, precedence, debounce, sensor_open):
+        with self.lock:
+            door = self.doors.get(devId)
+            self.doors[devId] = FusedDoor(devId, precedence or PRECEDENCE_SENSOR, debounce, sensor_open)
+            if door:
+                self.doors[devId].cloud_state = door.cloud_state
+                self.doors[devId].cloud_changed = door.cloud_changed
+
+    def remove(self, devId):
+        with self.lock:
+            self.doors.pop(devId, None)
+
+    def cloud_update(self, devId, door_state):
+        # Returns the opener's fused states
+        with self.lock:
+            door = self.doors[devId]
+            if door_state != door.cloud_state:
+                door.cloud_state = door_state
+                door.cloud_changed = time.time()
+            return door.states()
+
+    def sensor_update(self, devId, sensor_open):
+        with self.lock:
+            door = self.doors.get(devId)
+            if not door:
+                return
+            self.sensor_events += 1
+            door.sensor_raw = sensor_open
+            door.token += 1
+            if sensor_open == door.sensor_open:
+                return      # back where it was before the debounce ran out, nothing happened
+            token = door.token
+            self.call_later(door.debounce, lambda: self._settle(devId, token))
+
+    def _settle(self, devId, token):
+        with self.lock:
+            door = self.doors.get(devId)
+            if not door or door.token != token or door.sensor_raw == door.sensor_open:
+                return
+            self._set_sensor(door)
+        self.on_change(devId)
+
+    def _set_sensor(self, door):
+        # called with the lock held
+        self.logger.debug("DoorFusion: sensor for %s is now %s", door.devId, "open" if door.sensor_raw else "closed")
+        door.sensor_open = door.sensor_raw
+        door.sensor_changed = time.time()
+        self.sensor_changes += 1
+
+    def states(self, devId):
+        with self.lock:
+            return self.doors[devId].states()
+
+    def mismatch(self, devId):
+        with self.lock:
+            door = self.doors.get(devId)
+            return door is not None and door.mismatch()
+
+    def authoritative(self, devId):
+        # True if this opener's sensor decides its state, so it doesn't need the cloud polled to settle
+        with self.lock:
+            door = self.doors.get(devId)
+            return door is not None and door.precedence == PRECEDENCE_SENSOR and door.sensor_open is not None
@@ -0,0 +1,303 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import os
+import time
+import struct
+import logging
+import threading
+from datetime import datetime, timedelta
+
+MAX_FILE_BYTES = 1024 * 1024    # rotate the log at this size, about 58,000 records
+KEEP_FILES = 3                  # rotated files kept besides the current one
+READ_RECORDS = 4096             # records read at a time by the queries
+
+# time, Indigo device id, kind, state or command code, seconds (command confirmation time, negative if unconfirmed)
+RECORD = struct.Struct("<dIBBf")
+
+KIND_STATE = 1
+KIND_COMMAND = 2
+
+STATE_CODES = {"unknown": 0, "closed": 1, "open": 2, "opening": 3, "closing": 4, "stopped": 5, "transition": 6,
+               "autoreverse": 7, "on": 8, "off": 9}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+COMMAND_CODES = {"open": 1, "close": 2, "on": 3, "off": 4}
+COMMAND_NAMES = {code: name for name, code in COMMAND_CODES.items()}
+
+CLOSED_CODES = (STATE_CODES["closed"], STATE_CODES["unknown"], STATE_CODES["off"])
+
+
+def day_bounds(when):
+    # (start, end) of the local day holding `when`
+    start = datetime.fromtimestamp(when).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+################################################################################
+class DayTotals:
+    __slots__ = ("day_start", "day_end", "opens", "open_seconds", "open_since", "last_confirm")
+
+    def __init__(self, when, opens=0, open_seconds=0.0, open_since=None, last_confirm=None):
+        self.day_start, self.day_end = day_bounds(when)
+        self.opens = opens
+        self.open_seconds = open_seconds    # time open today up to open_since
+        self.open_since = open_since        # when the door's current open period started (or today did), None if closed
+        self.last_confirm = last_confirm
+
+    def roll(self, when):
+        # Start the day over if `when` is past its end
+        if when < self.day_end:
+            return
+        self.day_start, self.day_end = day_bounds(when)
+        self.opens = 0
+        self.open_seconds = 0.0
+        self.last_confirm = None
+        if self.open_since is not None:
+            self.open_since = self.day_start
+
+    def add(self, when, kind, code, value):
+        self.roll(when)
+        if kind == KIND_STATE:
+            if self.open_since is not None:
+                self.open_seconds += when - self.open_since
+            self.open_since = None if code in CLOSED_CODES else when
+            if code == STATE_CODES["open"]:
+                self.opens += 1
+        elif kind == KIND_COMMAND and value >= 0:
+            self.last_confirm = value
+
+
+################################################################################
+class StateHistory:
+    """
+    Append-only log of device state transitions and command results, one fixed-size binary record per event.
+
+    The log rotates when it reaches MAX_FILE_BYTES, keeping KEEP_FILES older files (history.bin, history.1.bin, ...).
+    Records are in time order, so the queries binary search for the first record they need and read from there in
+    chunks.  They never load a whole file.  With no path, nothing is kept.  Methods can be called from any thread.
+
+    Today's figures for each device are also kept as running totals, updated as records are written, so
+    today_summary() doesn't read the log after the first time it's asked about a device.
+    """
+
+    def __init__(self, path, max_bytes=MAX_FILE_BYTES, keep=KEEP_FILES):
+        self.logger = logging.getLogger("Plugin.StateHistory")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.file = None
+        self.records_written = 0
+        self.latest = {}            # device id -> (time, state code) of its last state record, or None if it has none
+        self.totals = {}            # device id -> DayTotals for today
+
+    def files(self):
+        # Oldest first
+        if not self.path:
+            return []
+        root, ext = os.path.splitext(self.path)
+        rotated = [f"{root}.{n}{ext}" for n in range(self.keep, 0, -1)]
+        return [path for path in rotated + [self.path] if os.path.exists(path)]
+
+    ########################################
+    # Writing
+    ########################################
+
+    def record_state(self, devId, state, now=None):
+        # Returns False, without writing anything, if it's the same as the device's last recorded state
+        code = STATE_CODES.get(state, 0)
+        latest = self.latest_state(devId)
+        if latest is not None and latest[1] == code:
+            return False
+        self._append(now or time.time(), devId, KIND_STATE, code, 0.0)
+        return True
+
+    def record_command(self, devId, command, seconds, confirmed, now=None):
+        self._append(now or time.time(), devId, KIND_COMMAND, COMMAND_CODES.get(command, 0),
+                     seconds if confirmed else -seconds)
+
+    def _append(self, when, devId, kind, code, value):
+        if not self.path:
+            return
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.file = open(self.path, "ab")
+                self.file.write(RECORD.pack(when, devId, kind, code, value))
+                self.file.flush()
+                self.records_written += 1
+                if kind == KIND_STATE:
+                    self.latest[devId] = (when, code)
+                if devId in self.totals:
+                    self.totals[devId].add(when, kind, code, value)
+                if self.file.tell() >= self.max_bytes:
+                    self._rotate()
+            except OSError as err:
+                self.logger.warning(f"Unable to write state history to {self.path}: {err}")
+                self.close_file()
+
+    def _rotate(self):
+        # called with the lock held
+        self.close_file()
+        root, ext = os.path.splitext(self.path)
+        for n in range(self.keep, 0, -1):
+            older = f"{root}.{n}{ext}"
+            newer = f"{root}.{n - 1}{ext}" if n > 1 else self.path
+            if os.path.exists(newer):
+                os.replace(newer, older)
+
+    def close_file(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        with self.lock:
+            self.close_file()
+
+    ########################################
+    # Reading
+    ########################################
+
+    def records(self, since=0.0, devId=None):
+        # Yields (time, device id, kind, code, value) from `since` on, oldest first
+        for path in self.files():
+            try:
+                with open(path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    count = size // RECORD.size
+                    if count == 0 or self._time_at(f, count - 1) < since:
+                        continue
+                    f.seek(self._first_at(f, count, since) * RECORD.size)
+                    while True:
+                        chunk = f.read(READ_RECORDS * RECORD.size)
+                        if len(chunk) < RECORD.size:
+                            break
+                        for record in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD.size]):
+                            if devId is None or record[1] == devId:
+                                yield record
+            except OSError as err:
+                self.logger.debug(f"Unable to read state history from {path}: {err}")
+
+    @staticmethod
+    def _time_at(f, index):
+        f.seek(index * RECORD.size)
+        return RECORD.unpack(f.read(RECORD.size))[0]
+
+    def _first_at(self, f, count, since):
+        # Index of the first record at or after `since`
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time_at(f, middle) < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def latest_state(self, devId):
+        # (time, state code) of the device's last state record, or None.  Read from the log once, then kept as records are written.
+        if devId not in self.latest:
+            found = None
+            for record_time, _, kind, code, _ in self.records(0.0, devId):
+                if kind == KIND_STATE:
+                    found = (record_time, code)
+            with self.lock:
+                self.latest.setdefault(devId, found)
+        return self.latest[devId]
+
+    def state_before(self, devId, when):
+        # The device's last recorded state before `when`, as a code, or None.  However long ago it was recorded.
+        latest = self.latest_state(devId)
+        if latest is None:
+            return None
+        if latest[0] < when:
+            return latest[1]
+        state = None
+        for record_time, _, kind, code, _ in self.records(0.0, devId):
+            if record_time >= when:
+                break
+            if kind == KIND_STATE:
+                state = code
+        return state
+
+    ########################################
+    # Queries
+    ########################################
+
+    def time_open_per_day(self, devId, days=7, now=None):
+        # [(date, seconds the door wasn't closed)] for the last `days` days, today last
+        now = now or time.time()
+        today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        starts = [(today - timedelta(days=n)).timestamp() for n in range(days - 1, -1, -1)]
+        totals = [0.0] * days
+
+        def add_open(start, end):
+            for n, day_start in enumerate(starts):
+                day_end = starts[n + 1] if n + 1 < days else now
+                overlap = min(end, day_end) - max(start, day_start)
+                if overlap > 0:
+                    totals[n] += overlap
+
+        state = self.state_before(devId, starts[0])
+        since = starts[0]
+        for record_time, _, kind, code, _ in self.records(starts[0], devId):
+            if kind != KIND_STATE:
+                continue
+            if state is not None and state not in CLOSED_CODES:
+                add_open(since, record_time)
+            state, since = code, record_time
+        if state is not None and state not in CLOSED_CODES:
+            add_open(since, now)
+        return [(datetime.fromtimestamp(start).date(), total) for start, total in zip(starts, totals)]
+
+    def today_summary(self, devId, now=None):
+        # Opens, seconds open and the last command confirmation time for one door today, from the running totals
+        now = now or time.time()
+        if devId not in self.totals:
+            day_start = day_bounds(now)[0]
+            summary = self.door_summary(devId, day_start)
+            open_seconds = self.time_open_per_day(devId, days=1, now=now)[0][1]
+            state = self.state_before(devId, now)
+            open_since = now if state is not None and state not in CLOSED_CODES else None
+            with self.lock:
+                self.totals.setdefault(devId, DayTotals(now, summary["opens"], open_seconds, open_since, summary["last_confirm"]))
+        with self.lock:
+            totals = self.totals[devId]
+            totals.roll(now)
+            open_seconds = totals.open_seconds
+            if totals.open_since is not None:
+                open_seconds += max(0.0, now - totals.open_since)
+            return {"opens": totals.opens, "open_seconds": open_seconds, "last_confirm": totals.last_confirm}
+
+    def transitions_per_hour(self, devId=None, hours=24, now=None):
+        # [(hour start time, state transitions)] for the last `hours` hours, the current hour last
+        now = now or time.time()
+        this_hour = now - now % 3600.0
+        first = this_hour - (hours - 1) * 3600.0
+        counts = [0] * hours
+        for record_time, _, kind, _, _ in self.records(first, devId):
+            if kind == KIND_STATE:
+                counts[min(int((record_time - first) // 3600.0), hours - 1)] += 1
+        return [(first + n * 3600.0, count) for n, count in enumerate(counts)]
+
+    def door_summary(self, devId, since):
+        # Opens, closes and command confirmation times for one door since a time
+        summary = {"opens": 0, "closes": 0, "commands": 0, "unconfirmed": 0, "confirm_total": 0.0, "confirm_max": 0.0,
+                   "last_confirm": None}
+        for _, _, kind, code, value in self.records(since, devId):
+            if kind == KIND_STATE:
+                if code == STATE_CODES["open"]:
+                    summary["opens"] += 1
+                elif code == STATE_CODES["closed"]:
+                    summary["closes"] += 1
+            elif kind == KIND_COMMAND:
+                summary["commands"] += 1
+                if value < 0:
+                    summary["unconfirmed"] += 1
+                else:
+                    summary["confirm_total"] += value
+                    summary["confirm_max"] = max(summary["confirm_max"], value)
+                    summary["last_confirm"] = value
+        return summary
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LATENCY_WINDOW = 200        # percentiles are computed over this many recent samples
+
+# Operations timed by the plugin.  Each has matching states on the MyQ Account device.
+METRIC_NAMES = (
+    "login",        # full login or token resume
+    "fetch",        # api.update_device_info()
+    "fanout",       # applying one MyQ device to its Indigo device
+    "command",      # sending a command until the cloud accepts it
+    "confirm",      # waiting for the cloud to confirm the new state
+    "triggers",     # evaluating triggers for one opener
+)
+
+
+################################################################################
+class Metric:
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.max = 0.0
+        self.last_error = ""
+        self.last_error_time = None
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds, error=None):
+        self.count += 1
+        self.samples.append(seconds)
+        self.max = max(self.max, seconds)
+        if error is not None:
+            self.record_error(error)
+
+    def record_error(self, error):
+        self.errors += 1
+        self.last_error = str(error) or error.__class__.__name__
+        self.last_error_time = time.time()
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50": round(self.percentile(50) * 1000.0, 1),
+            "p95": round(self.percentile(95) * 1000.0, 1),
+            "max": round(self.max * 1000.0, 1),
+            "lastError": self.last_error,
+        }
+
+
+################################################################################
+class Metrics:
+    """
+    Counters and latency percentiles for the plugin's hot paths.  Latencies are reported in milliseconds.
+    """
+
+    def __init__(self):
+        self.metrics = {name: Metric(name) for name in METRIC_NAMES}
+
+    def __getitem__(self, name):
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name)
+        return self.metrics[name]
+
+    @contextmanager
+    def timer(self, name):
+        # Times the block, and counts it as an error if it raises.  Works around awaits too.
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as err:
+            self[name].record(time.perf_counter() - start, err)
+            raise
+        else:
+            self[name].record(time.perf_counter() - start)
+
+    def states(self):
+        # Flat {state id: value} for the MyQ Account device
+        states = {}
+        for name in METRIC_NAMES:
+            for key, value in self.metrics[name].summary().items():
+                states[f"{name}_{key}"] = value
+        return states
+
+    def report(self):
+        lines = [f"{'':10} {'count':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}  last error"]
+        for name, metric in self.metrics.items():
+            summary = metric.summary()
+            lines.append(f"{name:10} {summary['count']:>8} {summary['errors']:>7} {summary['p50']:>9} {summary['p95']:>9} "
+                         f"{summary['max']:>9}  {summary['lastError']}")
+        return "\n".join(lines)
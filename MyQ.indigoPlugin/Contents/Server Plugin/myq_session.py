@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import os
+import json
+import asyncio
+import logging
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from aiohttp import ClientSession
+from pymyq import login
+from pymyq.api import API
+from pymyq.errors import MyQError, AuthenticationError
+
+TOKEN_REFRESH_MARGIN = timedelta(seconds=60)     # refresh this long before pymyq would
+
+
+################################################################################
+class MyQSession:
+    """
+    Long-lived MyQ cloud session.  Keeps one aiohttp ClientSession and one authenticated pymyq API
+    object for the life of the plugin, refreshes the security token before it expires, and saves
+    the token to disk so a plugin reload doesn't need a full OAuth login.
+    """
+
+    def __init__(self, username, password, token_file=None, metrics=None):
+        self.logger = logging.getLogger("Plugin.MyQSession")
+        self.username = username
+        self.password = password
+        self.token_file = token_file
+        self.metrics = metrics
+        self.web_session = None
+        self.api = None
+        self._saved_token = None
+        self._lock = asyncio.Lock()     # concurrent callers share one login
+
+    async def get_api(self):
+        async with self._lock:
+            if self.api is None:
+                with self.metrics.timer("login") if self.metrics else nullcontext():
+                    await self._start()
+            else:
+                await self._refresh_token()
+            self.save_token()
+            return self.api
+
+    async def reset(self):
+        # Called after an authentication failure, forces a full login on the next call
+        self.logger.debug("MyQSession: discarding API and saved token")
+        self.api = None
+        self._saved_token = None
+        self._delete_token()
+
+    async def close(self):
+        self.save_token()
+        self.api = None
+        if self.web_session and not self.web_session.closed:
+            await self.web_session.close()
+        self.web_session = None
+
+    async def _start(self):
+        if self.web_session is None or self.web_session.closed:
+            self.web_session = ClientSession()
+
+        api = None
+        security_token = self._load_token()
+        if security_token:
+            api = API(username=self.username, password=self.password, websession=self.web_session)
+            api._security_token = security_token
+            try:
+                await api.update_device_info()
+            except MyQError as err:
+                self.logger.debug(f"MyQSession: saved token not usable ({err}), doing full login")
+                api = None
+            else:
+                self.logger.debug("MyQSession: resumed session with saved token")
+
+        if api is None:
+            self.logger.debug("MyQSession: logging into MyQ server")
+            api = await login(self.username, self.password, self.web_session)
+
+        self.api = api
+
+    def ready(self):
+        # True if get_api() can return without calling the cloud: logged in, and the token isn't due for a refresh
+        if self.api is None:
+            return False
+        token, refresh_at, _ = self.api._security_token
+        return token is None or refresh_at is None or datetime.utcnow() + TOKEN_REFRESH_MARGIN < refresh_at
+
+    async def _refresh_token(self):
+        if self.ready():
+            return
+        refresh_at = self.api._security_token[1]
+        self.logger.debug(f"MyQSession: refreshing token due at {refresh_at}")
+        try:
+            await self.api.authenticate(wait=True)
+        except AuthenticationError:
+            await self.reset()
+            raise
+
+    ########################################
+    # Token persistence
+    ########################################
+
+    def save_token(self):
+        if not self.token_file or self.api is None:
+            return
+        token, refresh_at, last_refresh = self.api._security_token
+        if token is None or refresh_at is None:
+            return
+        if self._saved_token == (token, refresh_at):
+            return
+
+        token_data = {
+            "username": self.username,
+            "token": token,
+            "refresh_at": refresh_at.isoformat(),
+            "last_refresh": last_refresh.isoformat() if last_refresh else None,
+        }
+        # Written to a file that is owner-only from the start, then moved into place, so the token is never readable
+        # by others and a crash can't leave half a token behind
+        temp_file = f"{self.token_file}.tmp"
+        try:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)     # O_CREAT's mode only applies to a new file
+            with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                json.dump(token_data, f)
+            os.replace(temp_file, self.token_file)
+        except OSError as err:
+            self.logger.warning(f"Unable to save MyQ token to {self.token_file}: {err}")
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            return
+        self._saved_token = (token, refresh_at)
+        self.logger.debug(f"MyQSession: saved token, refresh due at {refresh_at}")
+
+    def _load_token(self):
+        if not self.token_file or not os.path.exists(self.token_file):
+            return None
+        try:
+            with open(self.token_file, "r") as f:
+                token_data = json.load(f)
+            if token_data.get("username") != self.username:
+                return None
+            refresh_at = datetime.fromisoformat(token_data["refresh_at"])
+            last_refresh = token_data.get("last_refresh")
+            last_refresh = datetime.fromisoformat(last_refresh) if last_refresh else None
+        except (OSError, ValueError, KeyError) as err:
+            self.logger.debug(f"MyQSession: unable to read saved token: {err}")
+            return None
+
+        # pymyq refreshes at half the token lifetime, so a token past its refresh time may already be dead
+        if datetime.utcnow() + TOKEN_REFRESH_MARGIN >= refresh_at:
+            self.logger.debug("MyQSession: saved token is stale")
+            return None
+
+        self._saved_token = (token_data["token"], refresh_at)
+        return token_data["token"], refresh_at, last_refresh
+
+    def _delete_token(self):
+        if self.token_file and os.path.exists(self.token_file):
+            try:
+                os.remove(self.token_file)
+            except OSError:
+                pass
@@ -2,25 +2,36 @@
 # -*- coding: utf-8 -*-
 ####################
 
+import os
 import time
 import requests
 import logging
-import json
+import threading
 
 import asyncio
 
 try:
-    from pymyq import login
-    from pymyq.errors import MyQError, RequestError
+    from pymyq.errors import RequestError
     from pymyq.__version__ import __version__
-    from aiohttp import ClientSession
 except ImportError:
     raise ImportError("'Required Python libraries missing.  Run 'pip3 install pymyq==3.1.6' in Terminal window, then reload plugin.")
 
 if __version__ != "3.1.6":
     raise ImportError("'Wrong version of MyQ library installed.  Run 'pip3 install pymyq==3.1.6' in Terminal window, then reload plugin.")
 
-kCurDevVersCount = 2  # current version of plugin devices
+from myq_session import MyQSession
+from accounts import CloudAccount, DEFAULT_ACCOUNT
+from records import DeviceCache
+from history import StateHistory
+from fusion import DoorFusion, DEFAULT_DEBOUNCE
+from triggers import TriggerEngine, EVENT_DOOR_SYNC, EVENT_DOOR_OPEN, EVENT_CLOUD_DOWN, EVENT_CLOUD_UP
+from resilience import CloudUnavailable, cancel, cancel_requested, classify, ERROR_AUTH, ERROR_CREDENTIALS, BREAKER_OPEN, BREAKER_CLOSED
+from stream import StreamClient
+from metrics import Metrics
+from tracing import Tracer, SUBSYSTEMS, subsystem_logger, set_log_levels
+from commands import CommandDispatcher, ConfirmationTracker, CONFIRM_TIMEOUT, COMMAND_OPEN, COMMAND_CLOSE, COMMAND_ON, COMMAND_OFF
+
+kCurDevVersCount = 3  # current version of plugin devices
 
 STATE_CLOSED = "closed"
 STATE_CLOSING = "closing"
@@ -31,6 +42,28 @@ STATE_TRANSITION = "transition"
 STATE_AUTOREVERSE = "autoreverse"
 STATE_UNKNOWN = "unknown"
 
+TRANSITIONAL_STATES = (STATE_OPENING, STATE_CLOSING, STATE_TRANSITION, STATE_AUTOREVERSE)
+
+# What an Indigo device shows as soon as the cloud accepts a command, until the cloud reports back
+OPTIMISTIC_STATES = {
+    COMMAND_OPEN: {"doorStatus": STATE_OPENING, "onOffState": False},
+    COMMAND_CLOSE: {"doorStatus": STATE_CLOSING, "onOffState": False},
+    COMMAND_ON: {"onOffState": True},
+    COMMAND_OFF: {"onOffState": False},
+}
+
+REFRESH_WINDOW = 0.5    # seconds a refresh waits for other requests to join it before fetching
+WARM_START_DELAY = 60.0     # after starting from the device cache, the first cloud poll waits this long
+
+
+def sensorOnState(dev):
+    # True if a linked sensor says the door is open, None if it isn't a sensor type we understand
+    if isinstance(dev, indigo.SensorDevice):
+        return dev.onState
+    elif isinstance(dev, indigo.MultiIODevice):
+        return not dev.states["binaryInput1"]  # I/O devices are opposite from sensors in terms of the state binary
+    return None
+
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -41,42 +74,330 @@ class Plugin(indigo.PluginBase):
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
 
-        self.logLevel = int(pluginPrefs.get("logLevel", logging.INFO))
-        self.indigo_log_handler.setLevel(self.logLevel)
-        log_format = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(msg)s',
+        log_format = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(message)s',
                                        datefmt='%Y-%m-%d %H:%M:%S')
         self.plugin_file_handler.setFormatter(log_format)
-        self.logger.debug(f"logLevel = {self.logLevel}")
-
-        self.needsUpdate = False
-        self.triggers = {}
+        # Hot paths log to their subsystem's logger with %-style arguments, formatted only if the level is enabled
+        self.poll_logger = subsystem_logger("poll")
+        self.command_logger = subsystem_logger("commands")
+        self.sensor_logger = subsystem_logger("sensors")
+        self.trigger_logger = subsystem_logger("triggers")
+        self.tracer = Tracer()
+        self.applyLogSettings(pluginPrefs)
+
+        self.refreshRequests = 0
+        self.refreshFetches = 0
+        self.trigger_engine = TriggerEngine(self.executeTrigger, self.call_later)
         self.myqOpeners = {}
         self.myqLamps = {}
+        self.myqAccounts = {}
+        self.serialToDevice = {}    # MyQ serial number (device address) -> Indigo device id
+        self.serialToAccount = {}   # MyQ serial number -> key of the account it was last seen in
+        self.deviceToSerial = {}
+        self.sensorToOpeners = {}   # linked sensor device id -> set of opener device ids
+        self.openerToSensor = {}
+        self.door_fusion = DoorFusion(self.fusedStateChanged, self.call_later)
+        self.appliedStates = {}     # Indigo device id -> {state key: last value written}
+        self.stateWritesIssued = 0
+        self.stateWritesSkipped = 0
         self.knownOpeners = {}
         self.knownLamps = {}
-        self.device_info = {}
+        self.device_records = DeviceCache()
+        self.device_cache_file = self.data_file("devices.json")
+        self.state_history = StateHistory(self.data_file("history.bin"))
+        self.warm_start_until = 0.0
 
         self.statusFrequency = float(self.pluginPrefs.get('statusFrequency', "10")) * 60.0
         self.logger.debug(f"statusFrequency = {self.statusFrequency}")
-        self.next_status_check = time.time()
+
+        # One event loop, on its own thread, and one MyQ session per account for the life of the plugin
+        self.event_loop = asyncio.new_event_loop()
+        self.event_loop_thread = None
+        self.poll_task = None
+        session = self.make_myq_session(DEFAULT_ACCOUNT, self.pluginPrefs.get('myqLogin', ""), self.pluginPrefs.get('myqPassword', ""))
+        self.accounts = {DEFAULT_ACCOUNT: CloudAccount(DEFAULT_ACCOUNT, "MyQ", session, self.statusFrequency,
+                                                       on_breaker_change=self.breakerChanged)}     # account key -> CloudAccount
+        self.command_dispatcher = CommandDispatcher(self.pymyq_command, self.commandComplete)
+        self.pending_commands = ConfirmationTracker()
+        self.stream_client = None
+        self.stream_task = None
 
     def startup(self):  # noqa
         self.logger.info("Starting MyQ")
+        self.loadDeviceCache()
+        self.event_loop_thread = threading.Thread(target=self.run_event_loop, name="MyQ Event Loop", daemon=True)
+        self.event_loop_thread.start()
+        self.poll_task = self.submit(self.poll_loop())
+        self.start_stream()
         indigo.devices.subscribeToChanges()  # Watch for changes to sensors associated with an opener
 
     def shutdown(self):  # noqa
         self.logger.info("Stopping MyQ")
+        if self.poll_task:
+            self.poll_task.cancel()
+        self.stop_stream()
+        try:
+            self.submit(self.command_dispatcher.cancel_all()).result(timeout=10.0)
+            self.submit(self.pending_commands.cancel_all()).result(timeout=10.0)
+            self.submit(self.cancel_tasks()).result(timeout=10.0)
+            for account in list(self.accounts.values()):
+                self.submit(account.session.close()).result(timeout=10.0)
+        except Exception as err:
+            self.logger.debug(f"shutdown: error closing MyQ session: {err}")
+        self.event_loop.call_soon_threadsafe(self.event_loop.stop)
+        if self.event_loop_thread:
+            self.event_loop_thread.join(timeout=10.0)
+        self.saveDeviceCache()
+        self.state_history.close()
+        self.tracer.close()
+
+    def applyLogSettings(self, prefs):
+        # Event log level, per-subsystem levels and the trace file, from the plugin preferences
+        try:
+            self.logLevel = int(prefs.get("logLevel", logging.INFO))
+        except (TypeError, ValueError):
+            self.logLevel = logging.INFO
+        levels = {}
+        for subsystem in SUBSYSTEMS:
+            try:
+                levels[subsystem] = int(prefs.get(f"logLevel_{subsystem}") or 0)
+            except (TypeError, ValueError):
+                levels[subsystem] = 0
+        set_log_levels(self.logger, (self.indigo_log_handler, self.plugin_file_handler), self.logLevel, levels)
+        self.tracer.set_path(self.data_file("trace.jsonl") if prefs.get("traceEnabled") else None)
+        self.logger.debug(f"logLevel = {self.logLevel}, subsystem levels = {levels}, trace file = {self.tracer.path}")
+
+    def data_file(self, filename):
+        # Path for a file in the plugin's preferences folder, or None if the folder can't be created
+        prefs_folder = f"{indigo.server.getInstallFolderPath()}/Preferences/Plugins/{self.pluginId}"
+        try:
+            os.makedirs(prefs_folder, exist_ok=True)
+        except OSError as err:
+            self.logger.warning(f"Unable to create {prefs_folder}, {filename} will not be saved: {err}")
+            return None
+        return f"{prefs_folder}/{filename}"
+
+    def make_myq_session(self, key, username, password):
+        token_file = self.data_file("token.json" if key == DEFAULT_ACCOUNT else f"token-{key}.json")
+        return MyQSession(username, password, token_file, Metrics())
+
+    def loadDeviceCache(self):
+        # Warm start: know the MyQ devices and their last states before the first cloud poll
+        if not self.device_cache_file or not os.path.exists(self.device_cache_file):
+            return
+        try:
+            count = self.device_records.load(self.device_cache_file)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.logger.warning(f"Unable to read MyQ device cache, waiting for the first cloud poll: {err}")
+            return
+        for record in self.device_records.records.values():
+            if record.family == 'garagedoor':
+                self.knownOpeners[record.serial] = record.name
+            elif record.family == 'lamp':
+                self.knownLamps[record.serial] = record.name
+            if record.account:
+                self.serialToAccount[record.serial] = record.account
+        self.logger.debug(f"loadDeviceCache: {count} devices, first cloud poll in {WARM_START_DELAY:.0f} seconds")
+        if count:
+            self.warm_start_until = time.time() + WARM_START_DELAY
+            self.accounts[DEFAULT_ACCOUNT].scheduler.defer(WARM_START_DELAY)
+
+    def saveDeviceCache(self):
+        if not self.device_cache_file or not self.device_records.dirty:
+            return
+        try:
+            self.device_records.save(self.device_cache_file)
+        except OSError as err:
+            self.logger.warning(f"Unable to save MyQ device cache: {err}")
+
+    def warmStart(self, device):
+        # True if this device's state came from the device cache and the deferred first poll will reconcile it
+        return time.time() < self.warm_start_until and device.pluginProps.get("address", device.address) in self.device_records
+
+    def accountFor(self, myqID):
+        # The account a MyQ device belongs to, the default account until it has been seen in a poll
+        return self.accounts.get(self.serialToAccount.get(myqID), self.accounts[DEFAULT_ACCOUNT])
+
+    def indigoDevice(self, myqID):
+        # The opener or lamp device for a MyQ serial number, or None
+        devId = self.serialToDevice.get(myqID)
+        return self.myqOpeners.get(devId) or self.myqLamps.get(devId)
+
+    def deviceAccountKey(self, device):
+        # Account key an Indigo device is tagged with, or None if it isn't known yet
+        key = self.serialToAccount.get(device.pluginProps.get("address", device.address))
+        if key is None:
+            key = device.pluginProps.get("account")
+        return key if key in self.accounts else None
+
+    ########################################
+    # Event loop methods
+    ########################################
+
+    def run_event_loop(self):
+        asyncio.set_event_loop(self.event_loop)
+        try:
+            self.event_loop.run_forever()
+        finally:
+            self.event_loop.run_until_complete(self.event_loop.shutdown_asyncgens())
+            self.event_loop.close()
+            self.logger.debug("MyQ event loop stopped")
+
+    async def cancel_tasks(self):
+        # Cancel everything still running on the loop (polls, refreshes, submitted work) and wait for it to finish
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            cancel(task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, coro):
+        # Schedule a coroutine on the plugin event loop from any thread, without waiting for it
+        future = asyncio.run_coroutine_threadsafe(coro, self.event_loop)
+        future.add_done_callback(self.submit_done)
+        return future
+
+    def submit_done(self, future):
+        if future.cancelled():
+            return
+        err = future.exception()
+        if err:
+            self.logger.error(f"Error in MyQ task: {err!r}")
+
+    def call_later(self, delay, callback):
+        # Run callback on the event loop after delay seconds, from any thread
+        self.event_loop.call_soon_threadsafe(self.event_loop.call_later, delay, callback)
 
-    def runConcurrentThread(self):
+    def submit_command(self, myqID, command):
+        # Hand a device command to the dispatcher on the event loop, from any thread
+        self.event_loop.call_soon_threadsafe(self.command_dispatcher.submit, myqID, command)
+
+    def start_stream(self):
+        streamURL = self.pluginPrefs.get('streamURL', "")
+        if not self.pluginPrefs.get('useStreaming', False) or not streamURL:
+            return
+        self.logger.debug(f"start_stream: {streamURL}")
+        try:
+            self.stream_client = StreamClient(streamURL, self.pluginPrefs.get('streamToken', ""), self.streamDeviceUpdate,
+                                              self.streamConnected)
+        except ValueError as err:
+            self.logger.warning(f"MyQ update stream not started: {err}")
+            return
+        self.stream_task = self.submit(self.stream_client.run())
+
+    def stop_stream(self):
+        if self.stream_task:
+            self.stream_task.cancel()
+        self.stream_task = None
+        self.stream_client = None
+        self.event_loop.call_soon_threadsafe(self.accounts[DEFAULT_ACCOUNT].scheduler.set_push_active, False)
+
+    def streamConnected(self, connected):
+        if connected:
+            self.logger.info("MyQ update stream connected")
+        else:
+            self.logger.info("MyQ update stream disconnected, polling for updates")
+        self.accounts[DEFAULT_ACCOUNT].scheduler.set_push_active(connected)
+
+    def streamDeviceUpdate(self, device_json):
+        # A pushed update may carry only the changed fields, merge it into what we already know about the device
+        myqID = device_json['serial_number']
+        api = self.accountFor(myqID).session.api
+        myq_device = api.devices.get(myqID) if api else None
+        record = self.device_records.get(myqID)
+        known = myq_device.device_json if myq_device else record.as_json() if record else None
+        if known:
+            merged = dict(known)
+            merged.update(device_json)
+            merged['state'] = dict(known.get('state', {}), **device_json.get('state', {}))
+        else:
+            merged = device_json
+        if not merged.get('device_family') or 'name' not in merged or 'state' not in merged:
+            self.poll_logger.debug("streamDeviceUpdate: ignoring update for unknown device %s", myqID)
+            return
+        if myq_device:
+            myq_device.device_json = merged
+        self.applyDeviceJson(merged)
+
+    async def poll_loop(self):
+        # Each account runs on its own schedule, and accounts that are due are fetched concurrently
+        while True:
+            for account in list(self.accounts.values()):
+                if account.breaker.retry_in() > 0:
+                    continue        # circuit breaker is open, wait for its next probe
+                if not account.refresh_in_flight() and account.scheduler.poll_due():
+                    # burst polls only follow the devices that started the burst, idle polls sweep the account
+                    watched = self.watchedDevices(account) if account.scheduler.in_burst() else None
+                    asyncio.ensure_future(self.refresh(account, serials=watched or None))
+            await asyncio.sleep(1.0)
+
+    def watchedDevices(self, account):
+        # This account's MyQ devices with a command waiting for confirmation, or a door in transit, unless the
+        # door's linked sensor already decides its state
+        return {serial for serial, record in self.device_records.records.items()
+                if record.account == account.key and (serial in self.pending_commands or record.state in TRANSITIONAL_STATES)
+                and not self.sensorAuthoritative(serial)}
+
+    def request_refresh(self, key=None):
+        # Ask for a device update from any thread, for one account or all of them.  Requests close together share a single fetch.
+        self.submit(self.refresh_accounts(key))
+
+    def request_device_refresh(self, myqID):
+        # Ask for an update of one MyQ device from any thread, without sweeping the rest of its account
+        self.submit(self.refresh(self.accountFor(myqID), force=True, serials={myqID}))
+
+    async def refresh_accounts(self, key=None):
+        accounts = [self.accounts[key]] if key in self.accounts else list(self.accounts.values())
+        await asyncio.gather(*(self.refresh(account, force=True) for account in accounts))
+
+    async def refresh(self, account, force=False, serials=None):
+        # Single-flight refresh per account: joins the refresh in flight if it covers these devices (or can still
+        # take them on), otherwise waits for it and starts another.  serials=None refreshes the whole account.
+        self.refreshRequests += 1
+        while account.refresh_in_flight() and not (account.refresh_covers(serials) or account.join_refresh(serials)):
+            await asyncio.shield(account.refresh_task)
+        if not account.refresh_in_flight():
+            if force:
+                account.scheduler.budget.consume(force=True)
+            account.refresh_targets = serials
+            account.refresh_started = False
+            account.refresh_task = asyncio.ensure_future(self.refresh_once(account))
+        return await asyncio.shield(account.refresh_task)
+
+    async def refresh_once(self, account):
+        await asyncio.sleep(REFRESH_WINDOW)
+        account.refresh_started = True
+        serials = account.refresh_targets
+        self.refreshFetches += 1
+        self.tracer.start("poll")
+        if self.tracer.enabled:
+            self.tracer.event("poll", "start", account=account.key, devices=sorted(serials) if serials else "all")
+        started = time.time()
+        transitional = False
         try:
-            while True:
-                if self.needsUpdate or (time.time() > self.next_status_check):
-                    self.next_status_check = time.time() + self.statusFrequency
-                    self.needsUpdate = False
-                    asyncio.run(self.pymyq_update())
-                self.sleep(1.0)
-        except self.StopThread:
-            self.logger.debug("Stopping runConcurrentThread")
+            if serials is None:
+                transitional = await self.pymyq_update(account)
+            else:
+                transitional = await self.pymyq_update_devices(account, serials)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            self.logger.error(f"Error updating MyQ devices for {account.name}: {err!r}")
+        if self.tracer.enabled:
+            self.tracer.event("poll", "done", account=account.key, status=account.status, transitional=bool(transitional),
+                              ms=round((time.time() - started) * 1000.0, 1))
+        if serials is None:
+            # keeps minutes open ticking over for doors left open, and starts each day over at midnight
+            for dev in list(self.myqOpeners.values()):
+                if self.deviceAccountKey(dev) == account.key:
+                    self.updateHistoryStates(dev)
+        if serials is None or account.scheduler.in_burst():
+            interval = account.scheduler.poll_done(bool(transitional))
+            self.poll_logger.debug("refresh_once: next poll for %s in %.0f seconds", account.name, interval)
+        elif transitional:
+            account.scheduler.start_burst()     # a one-off device refresh leaves the account's sweep schedule alone
+        self.updateAccountDevices()
+        self.saveDeviceCache()
+        return transitional
 
     def deviceStartComm(self, device):
 
@@ -117,14 +438,28 @@ class Plugin(indigo.PluginBase):
             self.logger.debug(f"{device.name}: deviceStartComm: Adding device ({device.id}) to self.myqOpeners")
             assert device.id not in self.myqOpeners
             self.myqOpeners[device.id] = device
-            self.needsUpdate = True
+            self.indexDevice(device.id, device.pluginProps.get("address", device.address))
+            self.indexSensor(device)
+            if not self.warmStart(device):
+                self.request_refresh(self.deviceAccountKey(device))
 
         elif device.deviceTypeId == 'myqLight':
 
             self.logger.debug(f"{device.name}: deviceStartComm: Adding device ({device.id}) to self.myqLamps")
             assert device.id not in self.myqLamps
             self.myqLamps[device.id] = device
-            self.needsUpdate = True
+            self.indexDevice(device.id, device.pluginProps.get("address", device.address))
+            if not self.warmStart(device):
+                self.request_refresh(self.deviceAccountKey(device))
+
+        elif device.deviceTypeId == 'myqAccount':
+
+            self.logger.debug(f"{device.name}: deviceStartComm: Adding device ({device.id}) to self.myqAccounts")
+            assert device.id not in self.myqAccounts
+            self.myqAccounts[device.id] = device
+            if device.pluginProps.get("myqLogin"):
+                self.startAccount(device)
+            self.updateAccountDevices()
 
     def deviceStopComm(self, device):
 
@@ -134,52 +469,243 @@ class Plugin(indigo.PluginBase):
             self.logger.debug(f"{device.name}: deviceStopComm: Removing device ({device.id}) from self.myqOpeners")
             assert device.id in self.myqOpeners
             del self.myqOpeners[device.id]
+            self.unindexDevice(device.id)
+            self.unindexSensor(device.id)
+            self.appliedStates.pop(device.id, None)
 
         elif device.deviceTypeId == 'myqLight':
             self.logger.debug(f"{device.name}: deviceStopComm: Removing device ({device.id}) from self.myqLamps")
             assert device.id in self.myqLamps
             del self.myqLamps[device.id]
+            self.unindexDevice(device.id)
+            self.appliedStates.pop(device.id, None)
+
+        elif device.deviceTypeId == 'myqAccount':
+            self.logger.debug(f"{device.name}: deviceStopComm: Removing device ({device.id}) from self.myqAccounts")
+            assert device.id in self.myqAccounts
+            del self.myqAccounts[device.id]
+            self.appliedStates.pop(device.id, None)
+            self.stopAccount(str(device.id))
+
+    def startAccount(self, device):
+        # A MyQ Account device with its own login is polled as a separate account
+        key = str(device.id)
+        try:
+            interval = float(device.pluginProps.get("statusFrequency") or 0) * 60.0 or None
+        except ValueError:
+            interval = None
+        session = self.make_myq_session(key, device.pluginProps["myqLogin"], device.pluginProps.get("myqPassword", ""))
+        account = self.accounts[key] = CloudAccount(key, device.name, session, self.statusFrequency, interval,
+                                                             self.breakerChanged)
+        self.logger.debug(f"{device.name}: startAccount: polling MyQ account {session.username}")
+        if time.time() < self.warm_start_until and key in self.serialToAccount.values():
+            account.scheduler.defer(self.warm_start_until - time.time())
+        else:
+            self.request_refresh(key)
+
+    def stopAccount(self, key):
+        account = self.accounts.pop(key, None)
+        if not account:
+            return
+        for myqID in account.serials:
+            if self.serialToAccount.get(myqID) == key:
+                del self.serialToAccount[myqID]
+        if account.refresh_task:
+            self.event_loop.call_soon_threadsafe(cancel, account.refresh_task)
+        self.submit(account.session.close())
+
+    def indexDevice(self, devId, address):
+        self.unindexDevice(devId)
+        if address:
+            self.serialToDevice[address] = devId
+            self.deviceToSerial[devId] = address
+
+    def unindexDevice(self, devId):
+        address = self.deviceToSerial.pop(devId, None)
+        if address and self.serialToDevice.get(address) == devId:
+            del self.serialToDevice[address]
+
+    def indexSensor(self, device):
+        self.unindexSensor(device.id)
+        if not device.pluginProps.get("use_sensor", False):
+            return
+        try:
+            sensorID = int(device.pluginProps.get("sensor"))
+        except (TypeError, ValueError):
+            return
+        self.sensorToOpeners.setdefault(sensorID, set()).add(device.id)
+        self.openerToSensor[device.id] = sensorID
+        try:
+            sensor_state = sensorOnState(indigo.devices[sensorID])
+        except (Exception,):
+            self.sensor_logger.debug("%s: linked sensor %s not found", device.name, sensorID)
+            sensor_state = None
+        try:
+            debounce = float(device.pluginProps.get("sensor_debounce") or DEFAULT_DEBOUNCE)
+        except ValueError:
+            debounce = DEFAULT_DEBOUNCE
+        self.door_fusion.configure(device.id, device.pluginProps.get("sensor_precedence"), debounce, sensor_state)
+
+    def unindexSensor(self, devId):
+        self.door_fusion.remove(devId)
+        sensorID = self.openerToSensor.pop(devId, None)
+        if sensorID is None:
+            return
+        openers = self.sensorToOpeners.get(sensorID)
+        if openers:
+            openers.discard(devId)
+            if not openers:
+                del self.sensorToOpeners[sensorID]
+
+    def updateDeviceStates(self, device, newStates):
+        # Write only the states that differ from what was last applied, in a single batch.  Returns True if anything changed.
+        applied = self.appliedStates.setdefault(device.id, {})
+        stateList = []
+        for key, value in newStates.items():
+            if applied.get(key, device.states.get(key)) == value:
+                self.stateWritesSkipped += 1
+            else:
+                stateList.append({'key': key, 'value': value})
+        if not stateList:
+            return False
+
+        device.updateStatesOnServer(stateList)
+        for state in stateList:
+            applied[state['key']] = state['value']
+        self.stateWritesIssued += len(stateList)
+        if self.tracer.enabled:
+            self.tracer.event("states", "write", device=device.id, states={state['key']: state['value'] for state in stateList})
+        return True
+
+    def recordHistory(self, device, newStates):
+        # Only for states the cloud or a linked sensor reported, never for a command's optimistic states
+        if device.id in self.myqOpeners and "doorStatus" in newStates:
+            if self.state_history.record_state(device.id, newStates["doorStatus"]):
+                self.updateHistoryStates(device)
+        elif device.id in self.myqLamps and "onOffState" in newStates:
+            self.state_history.record_state(device.id, "on" if newStates["onOffState"] else "off")
+
+    def updateHistoryStates(self, device):
+        # Today's figures for one door, from the state history's running totals
+        summary = self.state_history.today_summary(device.id)
+        states = {"opensToday": summary["opens"], "minutesOpenToday": round(summary["open_seconds"] / 60.0, 1)}
+        if summary["last_confirm"] is not None:
+            states["lastConfirmSeconds"] = round(summary["last_confirm"], 1)
+        self.updateDeviceStates(device, states)
+
+    def updateAccountDevices(self):
+        for device in self.myqAccounts.values():
+            # devices without their own login show the account from the plugin preferences
+            account = self.accounts.get(str(device.id), self.accounts[DEFAULT_ACCOUNT])
+            states = account.metrics.states()
+            states["status"] = "unavailable" if account.breaker.state == BREAKER_OPEN else account.status
+            states["cloudAvailable"] = account.breaker.available
+            states["breakerState"] = account.breaker.state
+            self.updateDeviceStates(device, states)
+
+    def breakerChanged(self, account, state):
+        if state == BREAKER_OPEN:
+            self.logger.warning(f"MyQ cloud unavailable for {account.name} after {account.breaker.failures} failures "
+                                f"({account.breaker.last_error}), next try in {account.breaker.retry_in():.0f} seconds")
+            self.trigger_engine.fire(EVENT_CLOUD_DOWN, account.key)
+        elif state == BREAKER_CLOSED:
+            self.logger.info(f"MyQ cloud available again for {account.name}")
+            self.trigger_engine.fire(EVENT_CLOUD_UP, account.key)
+        else:
+            self.logger.debug(f"breakerChanged: probing MyQ cloud for {account.name}")
+            return
+        self.updateAccountDevices()
+
+    def tagDeviceAccount(self, device, key):
+        if device.pluginProps.get("account") == key:
+            return
+        newProps = device.pluginProps
+        newProps["account"] = key
+        device.replacePluginPropsOnServer(newProps)
 
     def triggerStartProcessing(self, trigger):
-        self.logger.debug(f"Adding Trigger {trigger.name} ({trigger.id}) - {trigger.pluginTypeId}")
-        assert trigger.id not in self.triggers
-        self.triggers[trigger.id] = trigger
+        self.trigger_logger.debug("Adding Trigger %s (%s) - %s", trigger.name, trigger.id, trigger.pluginTypeId)
+        self.trigger_engine.register(trigger)
 
     def triggerStopProcessing(self, trigger):
-        self.logger.debug(f"Removing Trigger {trigger.name} ({trigger.id})")
-        assert trigger.id in self.triggers
-        del self.triggers[trigger.id]
+        self.trigger_logger.debug("Removing Trigger %s (%s)", trigger.name, trigger.id)
+        self.trigger_engine.unregister(trigger.id)
 
-    def triggerCheck(self, device):
-        try:
-            sensor = indigo.devices[int(device.pluginProps["sensor"])]
-        except (Exception,):
-            self.logger.debug(f"Skipping triggers, no linked sensor for MyQ device {device.name}")
-            return
+    def executeTrigger(self, trigger):
+        if self.tracer.enabled:
+            self.tracer.event("triggers", "execute", trigger=trigger.id, name=trigger.name, type=trigger.pluginTypeId)
+        indigo.trigger.execute(trigger)
 
-        for triggerId, trigger in sorted(self.triggers.items()):
-            self.logger.debug(f"Checking Trigger {trigger.name} ({trigger.id}), Type: {trigger.pluginTypeId}")
-            if isinstance(sensor, indigo.SensorDevice):
-                sensor_state = sensor.onState
-            elif isinstance(sensor, indigo.MultiIODevice):
-                sensor_state = not sensor.states[
-                    "binaryInput1"]  # I/O devices are opposite from sensors in terms of the state binary
-            else:
-                sensor_state = None
-            if device.onState == sensor_state:  # these values are supposed to be opposite due to difference between sensor and lock devices
-                indigo.trigger.execute(trigger)  # so execute the out of sync trigger when they're not opposite
+    def triggerCheck(self, device):
+        # Re-evaluate this opener's trigger conditions.  The engine only acts when a condition starts or clears.
+        with self.accountFor(device.pluginProps.get("address", device.address)).metrics.timer("triggers"):
+            states = self.appliedStates.get(device.id, {})
+            doorStatus = states.get("doorStatus", device.states.get("doorStatus"))
+            self.trigger_engine.set_condition(EVENT_DOOR_OPEN, device.id, doorStatus not in (STATE_CLOSED, STATE_UNKNOWN, None))
+
+            self.trigger_engine.set_condition(EVENT_DOOR_SYNC, device.id, self.door_fusion.mismatch(device.id))
+
+    def fusedStateChanged(self, devId):
+        # A linked sensor settled on a new value
+        dev = self.myqOpeners.get(devId)
+        if self.tracer.enabled:
+            self.tracer.event("sensors", "settled", device=devId)
+        if dev:
+            states = self.door_fusion.states(devId)
+            self.updateDeviceStates(dev, states)
+            self.recordHistory(dev, states)
+            self.triggerCheck(dev)
+
+    def sensorAuthoritative(self, myqID):
+        # True if a door's linked sensor decides its state, so the cloud needn't be polled fast to watch it settle
+        devId = self.serialToDevice.get(myqID)
+        return devId in self.myqOpeners and self.door_fusion.authoritative(devId)
 
     ########################################
     # Menu Methods
     ########################################
 
     def requestUpdate(self):
-        self.needsUpdate = True
+        self.request_refresh()
+        return True
+
+    def menuDumpHistory(self):
+        lines = []
+        for dev in sorted(self.myqOpeners.values(), key=lambda d: d.name):
+            week = self.state_history.time_open_per_day(dev.id, days=7)
+            summary = self.state_history.door_summary(dev.id, time.time() - 7 * 86400.0)
+            confirmed = summary["commands"] - summary["unconfirmed"]
+            average = summary["confirm_total"] / confirmed if confirmed else 0.0
+            lines.append(f"{dev.name}: last 7 days {summary['opens']} opens, {summary['closes']} closes, "
+                         f"{summary['commands']} commands ({summary['unconfirmed']} not confirmed, "
+                         f"confirmation average {average:.1f} s, max {summary['confirm_max']:.1f} s)")
+            lines.append("    minutes open: " + ", ".join(f"{day:%a} {seconds / 60.0:.0f}" for day, seconds in week))
+        hours = self.state_history.transitions_per_hour(hours=24)
+        lines.append("Transitions per hour, last 24 hours: " +
+                     ", ".join(f"{time.strftime('%H', time.localtime(start))}h {count}" for start, count in hours if count))
+        self.logger.info("MyQ Door History:\n" + "\n".join(lines))
+        return True
+
+    def menuDumpMetrics(self):
+        for account in self.accounts.values():
+            self.logger.info(f"MyQ Performance Metrics for {account.name}:\n{account.metrics.report()}")
         return True
 
     def menuDumpMyQ(self):
-        self.logger.info(
-            f"MyQ Devices:\n{json.dumps(self.device_info, sort_keys=True, indent=4, separators=(',', ': '))}")
+        self.logger.info(f"MyQ Devices:\n{self.device_records.report()}")
+        self.logger.info(f"State writes issued: {self.stateWritesIssued}, skipped (unchanged): {self.stateWritesSkipped}")
+        self.logger.info(f"Refresh requests: {self.refreshRequests}, cloud fetches: {self.refreshFetches}")
+        self.logger.info(f"Linked sensor events: {self.door_fusion.sensor_events}, debounced changes: {self.door_fusion.sensor_changes}")
+        self.logger.info(f"Triggers executed: {self.trigger_engine.fired_count}, conditions active: {len(self.trigger_engine.active)}")
+        self.logger.info(f"Commands confirmed: {self.pending_commands.confirmed}, not confirmed: {self.pending_commands.failed}, "
+                         f"pending: {len(self.pending_commands.pending)}")
+        for account in self.accounts.values():
+            self.logger.info(f"Account {account.name} ({account.session.username}): {account.status}, "
+                             f"{len(account.serials)} devices, next poll in {max(0.0, account.scheduler.next_poll - time.time()):.0f} seconds")
+        return True
+
+    def menuDumpTransitions(self):
+        self.logger.info(f"MyQ Recent State Changes:\n{self.device_records.transitions_report()}")
         return True
 
     ########################################
@@ -190,34 +716,53 @@ class Plugin(indigo.PluginBase):
         self.logger.debug(f"validateDeviceConfigUi, valuesDict = {valuesDict}")
         errorsDict = indigo.Dict()
 
-        if not valuesDict['address']:
+        if typeId == 'myqAccount':
+            if valuesDict.get('myqLogin') and not valuesDict.get('myqPassword'):
+                errorsDict['myqPassword'] = "Enter the MyQ login password for this account"
+            try:
+                statusFrequency = int(valuesDict.get('statusFrequency') or 0)
+                if statusFrequency and ((statusFrequency < 5) or (statusFrequency > (24 * 60))):
+                    errorsDict['statusFrequency'] = "Status frequency must be at least 5 min and no more than 24 hours"
+            except ValueError:
+                errorsDict['statusFrequency'] = "Status frequency must be a number of minutes"
+
+        elif not valuesDict['address']:
             errorsDict['address'] = "Invalid Device"
             self.logger.warning(f"validateDeviceConfigUi: invalid device ID")
 
+        else:
+            if typeId == 'myqOpener' and valuesDict.get('use_sensor'):
+                try:
+                    if float(valuesDict.get('sensor_debounce') or 0) < 0:
+                        errorsDict['sensor_debounce'] = "Debounce must not be negative"
+                except ValueError:
+                    errorsDict['sensor_debounce'] = "Debounce must be a number of seconds"
+            valuesDict['account'] = self.serialToAccount.get(valuesDict['address'], DEFAULT_ACCOUNT)
+
         if len(errorsDict) > 0:
             return False, valuesDict, errorsDict
+        if devId and (devId in self.myqOpeners or devId in self.myqLamps):
+            self.indexDevice(devId, valuesDict['address'])
         return True, valuesDict
 
-    def closedDeviceConfigUi(self, valuesDict, userCancelled, typeId, devId):
-        if not userCancelled:
+    def validateEventConfigUi(self, valuesDict, typeId, eventId):
+        errorsDict = indigo.Dict()
+        for field in ("delay", "minutes"):
+            if field not in valuesDict:
+                continue
             try:
-                self.logLevel = int(valuesDict[u"logLevel"])
-            except (Exception,):
-                self.logLevel = logging.INFO
-            self.indigo_log_handler.setLevel(self.logLevel)
-            self.logger.debug(f"logLevel = {self.logLevel}")
+                if float(valuesDict[field] or 0) < 0:
+                    errorsDict[field] = "Must not be negative"
+            except ValueError:
+                errorsDict[field] = "Must be a number"
+        if len(errorsDict) > 0:
+            return False, valuesDict, errorsDict
+        return True, valuesDict
 
     def validatePrefsConfigUi(self, valuesDict):
         self.logger.debug("validatePrefsConfigUi called")
         errorDict = indigo.Dict()
 
-        try:
-            self.logLevel = int(valuesDict[u"logLevel"])
-        except (Exception,):
-            self.logLevel = logging.INFO
-        self.indigo_log_handler.setLevel(self.logLevel)
-        self.logger.debug(u"logLevel = " + str(self.logLevel))
-
         if len(valuesDict['myqLogin']) < 5:
             errorDict['myqLogin'] = u"Enter your MyQ login name (email address)"
 
@@ -228,6 +773,9 @@ class Plugin(indigo.PluginBase):
         if (statusFrequency < 5) or (statusFrequency > (24 * 60)):
             errorDict['statusFrequency'] = u"Status frequency must be at least 5 min and no more than 24 hours"
 
+        if valuesDict.get('useStreaming') and not valuesDict.get('streamURL', "").startswith("wss://"):
+            errorDict['streamURL'] = u"Enter a secure websocket URL, starting with wss://"
+
         if len(errorDict) > 0:
             return False, valuesDict, errorDict
 
@@ -235,16 +783,24 @@ class Plugin(indigo.PluginBase):
 
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         if not userCancelled:
-            try:
-                self.logLevel = int(valuesDict[u"logLevel"])
-            except (Exception,):
-                self.logLevel = logging.INFO
-            self.indigo_log_handler.setLevel(self.logLevel)
-            self.logger.debug(f"logLevel = {self.logLevel}")
+            self.applyLogSettings(valuesDict)
 
             self.statusFrequency = float(self.pluginPrefs.get('statusFrequency', "10")) * 60.0
             self.logger.debug(f"statusFrequency = {self.statusFrequency}")
-            self.next_status_check = time.time() + self.statusFrequency
+            for account in self.accounts.values():
+                account.set_idle_interval(self.statusFrequency)
+
+            self.stop_stream()
+            self.start_stream()
+
+            session = self.accounts[DEFAULT_ACCOUNT].session
+            if (valuesDict['myqLogin'] != session.username) or (valuesDict['myqPassword'] != session.password):
+                self.logger.debug("MyQ login changed, starting new session")
+                self.accounts[DEFAULT_ACCOUNT].breaker.record_success()     # new credentials deserve a try right away
+                self.submit(session.reset())
+                self.submit(session.close())
+                session.username = valuesDict['myqLogin']
+                session.password = valuesDict['myqPassword']
 
     def availableDeviceList(self, dev_filter="", valuesDict=None, typeId="", targetId=0):
 
@@ -257,12 +813,13 @@ class Plugin(indigo.PluginBase):
 
             for myqID, myqName in self.knownOpeners.items():
                 if myqID not in in_use:
-                    retList.append((myqID, myqName))
+                    retList.append((myqID, self.knownDeviceLabel(myqID, myqName)))
 
             if targetId:
                 try:
                     dev = indigo.devices[targetId]
-                    retList.insert(0, (dev.pluginProps["address"], self.knownOpeners[dev.pluginProps["address"]]))
+                    address = dev.pluginProps["address"]
+                    retList.insert(0, (address, self.knownDeviceLabel(address, self.knownOpeners[address])))
                 except (Exception,):
                     pass
 
@@ -272,18 +829,31 @@ class Plugin(indigo.PluginBase):
 
             for myqID, myqName in self.knownLamps.items():
                 if myqID not in in_use:
-                    retList.append((myqID, myqName))
+                    retList.append((myqID, self.knownDeviceLabel(myqID, myqName)))
 
             if targetId:
                 try:
                     dev = indigo.devices[targetId]
-                    retList.insert(0, (dev.pluginProps["address"], self.knownLamps[dev.pluginProps["address"]]))
+                    address = dev.pluginProps["address"]
+                    retList.insert(0, (address, self.knownDeviceLabel(address, self.knownLamps[address])))
                 except (Exception,):
                     pass
 
         self.logger.debug(f"availableDeviceList for {dev_filter}: retList = {retList}")
         return retList
 
+    def accountList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        return [("", "Any Account")] + [(key, account.name) for key, account in self.accounts.items()]
+
+    def openerList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        return [("", "Any Door")] + [(str(devId), dev.name) for devId, dev in self.myqOpeners.items()]
+
+    def knownDeviceLabel(self, myqID, myqName):
+        # With more than one account, show which account each MyQ device belongs to
+        if len(self.accounts) < 2:
+            return myqName
+        return f"{myqName} ({self.accountFor(myqID).name})"
+
     ################################################################################
     #
     # delegate methods for indigo.devices.subscribeToChanges()
@@ -292,82 +862,98 @@ class Plugin(indigo.PluginBase):
 
     def deviceDeleted(self, dev):
         indigo.PluginBase.deviceDeleted(self, dev)
-        self.logger.debug(f"deviceDeleted: {dev.name} ")
 
-        for myqDeviceId, myqDevice in sorted(self.myqOpeners.items()):
-            try:
-                sensorDev = myqDevice.pluginProps["sensor"]
-            except (Exception,):
-                return
+        if dev.pluginId == self.pluginId and dev.deviceTypeId == 'myqOpener':
+            # Conditions outlive a comm restart, so an open door doesn't fire its triggers again.  Only a deleted
+            # opener's episode is over.
+            self.trigger_engine.set_condition(EVENT_DOOR_OPEN, dev.id, False)
+            self.trigger_engine.set_condition(EVENT_DOOR_SYNC, dev.id, False)
+            return
 
-            try:
-                sensorID = int(sensorDev)
-            except (Exception,):
-                return
+        openerIds = self.sensorToOpeners.get(dev.id)
+        if not openerIds:
+            return
 
-            if dev.id == sensorID:
-                self.logger.info(f"A device ({dev.name}) that was associated with a MyQ device has been deleted.")
-                newProps = myqDevice.pluginProps
-                newProps["sensor"] = ""
-                myqDevice.replacePluginPropsOnServer(newProps)
+        self.logger.info(f"A device ({dev.name}) that was associated with a MyQ device has been deleted.")
+        for myqDeviceId in list(openerIds):
+            self.unindexSensor(myqDeviceId)
+            myqDevice = self.myqOpeners[myqDeviceId]
+            newProps = myqDevice.pluginProps
+            newProps["sensor"] = ""
+            myqDevice.replacePluginPropsOnServer(newProps)
+
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        # The account tag is written from the poll path, restarting the device for it would reset its triggers
+        origProps = dict(origDev.pluginProps)
+        newProps = dict(newDev.pluginProps)
+        origProps.pop("account", None)
+        newProps.pop("account", None)
+        return origProps != newProps
 
     def deviceUpdated(self, origDev, newDev):
         indigo.PluginBase.deviceUpdated(self, origDev, newDev)
 
-        for myqDeviceId, myqDevice in sorted(self.myqOpeners.items()):
-            try:
-                sensorDev = int(myqDevice.pluginProps["sensor"])
-            except (Exception,):
-                pass
+        if newDev.id in self.myqLamps and origDev.pluginProps != newDev.pluginProps:
+            self.myqLamps[newDev.id] = newDev
+            return
+
+        if newDev.id in self.myqOpeners and origDev.pluginProps != newDev.pluginProps:
+            self.myqOpeners[newDev.id] = newDev
+            if not self.didDeviceCommPropertyChange(origDev, newDev):
+                return      # only the account tag changed
+            self.indexSensor(newDev)
+            # states and triggers are only touched on the event loop
+            if newDev.id in self.door_fusion:
+                self.event_loop.call_soon_threadsafe(self.fusedStateChanged, newDev.id)
             else:
-                if origDev.id == sensorDev:
-                    if isinstance(newDev, indigo.SensorDevice):
-                        old_sensor_state = origDev.onState
-                        sensor_state = newDev.onState
-                    elif isinstance(newDev, indigo.MultiIODevice):
-                        old_sensor_state = not origDev.states[
-                            "binaryInput1"]  # I/O devices are opposite from sensors in terms of the state binary
-                        sensor_state = not newDev.states["binaryInput1"]
-                    else:
-                        self.logger.error(f"deviceUpdated: unknown device type for {origDev.name}")
-                        return
-
-                    if old_sensor_state == sensor_state:
-                        self.logger.debug(f"deviceUpdated: {origDev.name} has not changed")
-                        return
-
-                    self.logger.debug(f"deviceUpdated: {origDev.name} has changed state: {sensor_state}")
-                    # sensor "On" means the door's open, which is False for lock type devices (unlocked)
-                    # sensor "Off" means the door's closed, which is True for lock type devices (locked)
-                    if sensor_state:
-                        myqDevice.updateStateOnServer(key="onOffState", value=False)
-                    else:
-                        myqDevice.updateStateOnServer(key="onOffState", value=True)
-                    self.triggerCheck(myqDevice)
+                self.event_loop.call_soon_threadsafe(self.triggerCheck, newDev)
+            return
+
+        openerIds = self.sensorToOpeners.get(newDev.id)
+        if not openerIds:
+            return
+
+        sensor_state = sensorOnState(newDev)
+        if sensor_state is None:
+            self.logger.error(f"deviceUpdated: unknown device type for {origDev.name}")
+            return
+        if sensorOnState(origDev) == sensor_state:
+            return
+
+        # sensor "On" means the door's open.  DoorFusion debounces it and calls fusedStateChanged() on the event loop once it settles.
+        self.sensor_logger.debug("deviceUpdated: %s has changed state: %s", origDev.name, sensor_state)
+        self.tracer.start("sensor")
+        if self.tracer.enabled:
+            self.tracer.event("sensors", "change", sensor=newDev.id, open=sensor_state)
+        for myqDeviceId in openerIds:
+            self.door_fusion.sensor_update(myqDeviceId, sensor_state)
 
     ########################################
 
     def actionControlDevice(self, action, dev):
 
         if action.deviceAction == indigo.kDeviceAction.Unlock:
-            self.logger.debug(f"actionControlDevice: Unlock {dev.name}")
-            asyncio.run(self.pymyq_open(dev.address))
+            self.command_logger.debug("actionControlDevice: Unlock %s", dev.name)
+            self.submit_command(dev.address, COMMAND_OPEN)
 
         elif action.deviceAction == indigo.kDeviceAction.Lock:
-            self.logger.debug(f"actionControlDevice: Lock {dev.name}")
-            asyncio.run(self.pymyq_close(dev.address))
+            self.command_logger.debug("actionControlDevice: Lock %s", dev.name)
+            self.submit_command(dev.address, COMMAND_CLOSE)
 
         elif action.deviceAction == indigo.kDeviceAction.TurnOn:
-            self.logger.debug(f"actionControlDevice: TurnOn {dev.name}")
-            asyncio.run(self.pymyq_turnon(dev.address))
+            self.command_logger.debug("actionControlDevice: TurnOn %s", dev.name)
+            self.submit_command(dev.address, COMMAND_ON)
 
         elif action.deviceAction == indigo.kDeviceAction.TurnOff:
-            self.logger.debug(f"actionControlDevice: TurnOff {dev.name}")
-            asyncio.run(self.pymyq_turnoff(dev.address))
+            self.command_logger.debug("actionControlDevice: TurnOff %s", dev.name)
+            self.submit_command(dev.address, COMMAND_OFF)
 
         elif action.deviceAction == indigo.kDeviceAction.RequestStatus:
-            self.logger.debug("actionControlDevice: Request Status")
-            asyncio.run(self.pymyq_update())
+            self.poll_logger.debug("actionControlDevice: Request Status for %s", dev.name)
+            if dev.address:
+                self.request_device_refresh(dev.address)
+            else:
+                self.request_refresh()
 
         else:
             self.logger.error(f"actionControlDevice: Unsupported action requested: {action} for {dev.name}")
@@ -381,162 +967,347 @@ class Plugin(indigo.PluginBase):
             myqDevice = indigo.devices[pluginAction.deviceId]
             myqActionId = pluginAction.pluginTypeId
             if myqActionId == "openDoor":
-                asyncio.run(self.pymyq_open(myqDevice.address))
+                self.submit_command(myqDevice.address, COMMAND_OPEN)
             elif myqActionId == "closeDoor":
-                asyncio.run(self.pymyq_close(myqDevice.address))
+                self.submit_command(myqDevice.address, COMMAND_CLOSE)
             else:
                 self.logger.debug(f"changeDeviceAction, unknown myqActionId = {myqActionId}")
                 return
 
     ################################################################################
 
-    async def pymyq_update(self):
-        async with ClientSession() as web_session:
-            try:
-                api = await login(self.pluginPrefs['myqLogin'], self.pluginPrefs['myqPassword'], web_session)
-            except MyQError as err:
-                self.logger.warning(f"Error logging into MyQ server: {err}")
-                return
+    def cloudError(self, account, message, err):
+        # Warn about failures until the circuit breaker opens, after that breakerChanged() does the talking
+        if self.tracer.enabled:
+            self.tracer.event("cloud", "error", account=account.key, message=message, error=repr(err))
+        if account.breaker.available or classify(err) == ERROR_CREDENTIALS:
+            self.logger.warning(f"{message} for {account.name}: {str(err) or err.__class__.__name__}")
+        else:
+            self.logger.debug(f"{message} for {account.name}: {err!r}")
 
-            await api.update_device_info()
-
-            for device_id in api.devices:
-                device_json = api.devices[device_id].device_json
-                name = device_json['name']
-                myqID = device_json['serial_number']
-                family = device_json['device_family']
-                self.logger.debug(f"pymyq_update: got {name} - {family} ({myqID})")
-                self.device_info[myqID] = device_json
-
-                if family == 'garagedoor':
-
-                    state = device_json['state']['door_state']
-                    self.logger.debug(f"pymyq_read: door state = {state}")
-
-                    if myqID not in self.knownOpeners:
-                        self.knownOpeners[myqID] = name
-
-                    for dev in indigo.devices.iter(filter="self.myqOpener"):
-                        self.logger.debug(f'Checking Opener Device: {dev.name} ({dev.address}) against {myqID}')
-                        if dev.address == myqID:
-                            dev.updateStateOnServer(key="doorStatus", value=state)
-                            if state == STATE_CLOSED:
-                                dev.updateStateOnServer(key="onOffState", value=True)  # closed is True (Locked)
-                            else:
-                                dev.updateStateOnServer(key="onOffState",
-                                                        value=False)  # anything other than closed is "Unlocked"
-                            self.triggerCheck(dev)
-                            break
-
-                elif family == 'lamp':
-                    state = device_json['state']['lamp_state']
-                    self.logger.debug(f"pymyq_read: lamp state = {state}")
-
-                    if myqID not in self.knownLamps:
-                        self.knownLamps[myqID] = name
-
-                    for dev in indigo.devices.iter(filter="self.myqLight"):
-                        self.logger.debug(
-                            f"Checking Lamp Device: {dev.name} ({dev.address}) against {myqID}")
-                        if dev.address == myqID:
-                            if state == "on":
-                                dev.updateStateOnServer(key="onOffState", value=True)
-                            else:
-                                dev.updateStateOnServer(key="onOffState", value=False)
-                            break
+    async def get_myq_api(self, account):
+        if account.session.ready():
+            return account.session.api      # nothing for the circuit breaker to judge
+        try:
+            return await account.policy.call(account.session.get_api, attempts=2)
+        except CloudUnavailable as err:
+            self.logger.debug(f"get_myq_api: {account.name}: {err}")
+        except Exception as err:
+            self.cloudError(account, "Error logging into MyQ server", err)
+        return None
+
+    async def pymyq_update(self, account):
+        api = await self.get_myq_api(account)
+        if not api:
+            if account.breaker.available:
+                account.status = "login failed"
+            return
 
-    async def pymyq_open(self, myqid):
-        async with ClientSession() as web_session:
-            try:
-                api = await login(self.pluginPrefs['myqLogin'], self.pluginPrefs['myqPassword'], web_session)
-            except MyQError as err:
-                self.logger.warning(f"Error logging into MyQ server: {err}")
-                return
+        try:
+            with account.metrics.timer("fetch"):
+                await account.policy.call(api.update_device_info)
+        except CloudUnavailable:
+            return
+        except Exception as err:
+            self.cloudError(account, "Error updating MyQ devices", err)
+            if account.breaker.available:
+                account.status = "login failed" if classify(err) == ERROR_AUTH else "update failed"
+            return
+        account.status = "ok"
+
+        # forget devices this account no longer has, unless another account has claimed them since
+        for myqID in account.serials.difference(api.devices):
+            if self.serialToAccount.get(myqID) == account.key:
+                del self.serialToAccount[myqID]
+        for myqID in self.device_records.evict(account.key, api.devices):
+            self.poll_logger.debug("pymyq_update: %s no longer in account %s", myqID, account.name)
+            self.knownOpeners.pop(myqID, None)
+            self.knownLamps.pop(myqID, None)
+        account.serials = set(api.devices)
+
+        transitional = False
+        for device_id in api.devices:
+            self.serialToAccount[device_id] = account.key
+            with account.metrics.timer("fanout"):
+                if self.applyDeviceJson(api.devices[device_id].device_json):
+                    transitional = True
+        return transitional
+
+    async def pymyq_update_devices(self, account, serials):
+        # Fetch only the MyQ accounts (households) that hold these devices, and update only their Indigo devices.
+        # pymyq has no single device fetch: a device's update() fetches its whole household.
+        api = await self.get_myq_api(account)
+        if not api:
+            return False
+        myq_accounts = {api.devices[myqID].account for myqID in serials if myqID in api.devices}
+        if not myq_accounts:
+            return await self.pymyq_update(account)     # not fetched yet, nothing to target
 
-            device = api.devices[myqid]
-            if not device.open_allowed:
-                self.logger.warning(f"Opening of '{device.name}' is not allowed.")
-                return
+        try:
+            with account.metrics.timer("fetch"):
+                await asyncio.gather(*(account.policy.call(myq_account.update) for myq_account in myq_accounts))
+        except CloudUnavailable:
+            return False
+        except Exception as err:
+            self.cloudError(account, "Error updating MyQ devices", err)
+            return False
+
+        transitional = False
+        for myqID in serials:
+            if myqID in api.devices:
+                with account.metrics.timer("fanout"):
+                    if self.applyDeviceJson(api.devices[myqID].device_json):
+                        transitional = True
+        return transitional
+
+    def applyDeviceJson(self, device_json):
+        # Update the Indigo device for one MyQ device.  Returns True if it's a door in a transitional state.
+        name = device_json['name']
+        myqID = device_json['serial_number']
+        family = device_json['device_family']
+        self.poll_logger.debug("pymyq_update: got %s - %s (%s)", name, family, myqID)
+        self.device_records.update(device_json, self.serialToAccount.get(myqID))
+
+        if family == 'garagedoor':
+
+            state = device_json['state']['door_state']
+            self.poll_logger.debug("pymyq_read: door state = %s", state)
+
+            if myqID not in self.knownOpeners:
+                self.knownOpeners[myqID] = name
+
+            dev = self.myqOpeners.get(self.serialToDevice.get(myqID))
+            if dev and self.pending_commands.holding(myqID, device_json):
+                self.poll_logger.debug("%s: command pending, cloud has nothing newer", dev.name)
+                return True
+            if dev:
+                self.poll_logger.debug("Updating Opener Device: %s (%s)", dev.name, dev.address)
+                self.tagDeviceAccount(dev, self.serialToAccount.get(myqID, DEFAULT_ACCOUNT))
+                if dev.id in self.door_fusion:
+                    states = self.door_fusion.cloud_update(dev.id, state)
+                else:
+                    # closed is True (Locked), anything other than closed is "Unlocked"
+                    states = {"doorStatus": state, "onOffState": (state == STATE_CLOSED)}
+                self.updateDeviceStates(dev, states)
+                self.recordHistory(dev, states)
+                if self.pending_commands.error_cleared(myqID, device_json):
+                    dev.setErrorStateOnServer(None)
+                self.triggerCheck(dev)
+            return state in TRANSITIONAL_STATES and not self.sensorAuthoritative(myqID)
+
+        elif family == 'lamp':
+            state = device_json['state']['lamp_state']
+            self.poll_logger.debug("pymyq_read: lamp state = %s", state)
+
+            if myqID not in self.knownLamps:
+                self.knownLamps[myqID] = name
+
+            dev = self.myqLamps.get(self.serialToDevice.get(myqID))
+            if dev and self.pending_commands.holding(myqID, device_json):
+                self.poll_logger.debug("%s: command pending, cloud has nothing newer", dev.name)
+                return False
+            if dev:
+                self.poll_logger.debug("Updating Lamp Device: %s (%s)", dev.name, dev.address)
+                self.tagDeviceAccount(dev, self.serialToAccount.get(myqID, DEFAULT_ACCOUNT))
+                states = {"onOffState": (state == "on")}
+                self.updateDeviceStates(dev, states)
+                self.recordHistory(dev, states)
+                if self.pending_commands.error_cleared(myqID, device_json):
+                    dev.setErrorStateOnServer(None)
+
+        return False
+
+    async def pymyq_command(self, myqid, command):
+        # Runs on the device's command worker.  Everything this command starts, confirmation included, shares its trace id.
+        self.tracer.start("cmd")
+        if self.tracer.enabled:
+            self.tracer.event("commands", "start", serial=myqid, command=command)
+        result = await self.send_command(myqid, command)
+        if result is None and self.tracer.enabled:
+            self.tracer.event("commands", "not sent", serial=myqid, command=command)
+        return result
+
+    async def send_command(self, myqid, command):
+        account = self.accountFor(myqid)
+        if account.breaker.retry_in() > 0:
+            self.command_logger.warning(f"MyQ cloud unavailable for {account.name}, '{command}' for {myqid} not sent. "
+                                f"Next try in {account.breaker.retry_in():.0f} seconds.")
+            return None
+        if command == COMMAND_OPEN:
+            return await self.pymyq_open(myqid)
+        elif command == COMMAND_CLOSE:
+            return await self.pymyq_close(myqid)
+        elif command == COMMAND_ON:
+            return await self.pymyq_turnon(myqid)
+        elif command == COMMAND_OFF:
+            return await self.pymyq_turnoff(myqid)
+        self.command_logger.error(f"send_command: unknown command {command} for {myqid}")
+        return None
+
+    def commandComplete(self, myqid, command, result):
+        # Called by the dispatcher as soon as the cloud accepts (or refuses) this device's command
+        self.command_logger.debug("commandComplete: %s for %s, result = %s", command, myqid, result)
+        api = self.accountFor(myqid).session.api
+        if result is None or not api or myqid not in api.devices:
+            return
+        self.applyDeviceJson(api.devices[myqid].device_json)
+        self.updateAccountDevices()
+
+    def commandAccepted(self, myqid, device, command, wait_task, last_update):
+        # Show where the device is heading right away, and confirm it with the cloud in the background
+        if self.tracer.enabled:
+            self.tracer.event("commands", "accepted", serial=myqid, command=command)
+        had_error = myqid in self.pending_commands.errors
+        self.pending_commands.start(myqid, command, last_update, wait_task,
+                                    lambda pending: self.trackConfirmation(pending, device, wait_task))
+        dev = self.indigoDevice(myqid)
+        if dev:
+            if had_error:
+                dev.setErrorStateOnServer(None)
+            self.updateDeviceStates(dev, OPTIMISTIC_STATES[command])
+            if dev.id in self.myqOpeners:
+                self.triggerCheck(dev)
+        return True
 
-            if device.state == STATE_OPEN:
-                self.logger.info(f"'{device.name}' is already open.")
-                return
+    async def trackConfirmation(self, pending, device, wait_task):
+        confirmed = None
+        try:
+            confirmed = bool(await self.confirmCommand(wait_task, self.accountFor(pending.serial).metrics))
+        finally:
+            # superseded or shut down, the command still mustn't stay pending
+            self.pending_commands.finish(pending, confirmed)
+        if self.tracer.enabled:
+            self.tracer.event("commands", "confirmed" if confirmed else "not confirmed", serial=pending.serial,
+                              command=pending.command, seconds=round(time.time() - pending.started, 1))
+        if not confirmed:
+            self.accountFor(pending.serial).metrics["confirm"].record_error(f"{device.name} not confirmed")
+            self.command_logger.warning(f"'{pending.command}' for '{device.name}' was not confirmed by MyQ within "
+                                f"{CONFIRM_TIMEOUT:.0f} seconds.")
+
+        # whatever happened, show what the cloud last reported
+        self.applyDeviceJson(device.device_json)
+        dev = self.indigoDevice(pending.serial)
+        if dev:
+            self.state_history.record_command(dev.id, pending.command, time.time() - pending.started, confirmed)
+            if dev.id in self.myqOpeners:
+                self.updateHistoryStates(dev)
+        if not confirmed:
+            self.pending_commands.fail(pending.serial, device.device_json)
+            if dev:
+                dev.setErrorStateOnServer("not confirmed")
+        return confirmed
+
+    async def confirmCommand(self, wait_task, metrics):
+        # pymyq returns True if the device was already in the requested state, otherwise a task that polls until it is
+        if isinstance(wait_task, bool):
+            return wait_task
+        try:
+            with metrics.timer("confirm"):
+                # shielded, so pymyq's own task keeps running: it guards the next command for this device
+                return await asyncio.wait_for(asyncio.shield(wait_task), CONFIRM_TIMEOUT)
+        except asyncio.CancelledError:
+            if cancel_requested():
+                raise
+            self.command_logger.debug("confirmCommand: pymyq's confirmation task was cancelled")
+            return False
+        except Exception as err:
+            self.command_logger.debug("confirmCommand: error waiting for confirmation: %r", err)
+            return False
 
-            try:
-                wait_task = await device.open(wait_for_state=False)
-            except MyQError as err:
-                self.logger.error(f"Error trying to open '{device.name}': {err}")
-                return
+    async def pymyq_open(self, myqid):
+        account = self.accountFor(myqid)
+        api = await self.get_myq_api(account)
+        if not api:
+            return
 
-            if not await wait_task:
-                self.logger.warning(f"Failed to open '{device.name}'.")
-            self.needsUpdate = True
+        device = api.devices[myqid]
+        await self.pending_commands.settled(myqid)
+        if not device.open_allowed:
+            self.command_logger.warning(f"Opening of '{device.name}' is not allowed.")
             return
 
-    async def pymyq_close(self, myqid):
-        async with ClientSession() as web_session:
-            try:
-                api = await login(self.pluginPrefs['myqLogin'], self.pluginPrefs['myqPassword'], web_session)
-            except MyQError as err:
-                self.logger.warning(f"Error logging into MyQ server: {err}")
-                return
+        if device.state == STATE_OPEN:
+            self.command_logger.info(f"'{device.name}' is already open.")
+            return
 
-            device = api.devices[myqid]
-            if not device.close_allowed:
-                self.logger.warning(f"Closing of '{device.name}' is not allowed.")
-                return
+        account.scheduler.budget.consume(force=True)
+        last_update = device.device_json["state"].get("last_update")
+        try:
+            with account.metrics.timer("command"):
+                wait_task = await account.policy.call(device.open, False, timeout=None)
+        except Exception as err:
+            self.command_logger.error(f"Error trying to open '{device.name}': {err}")
+            return
 
-            if device.state == STATE_CLOSED:
-                self.logger.info(f"'{device.name}' is already closed.")
-                return
+        if not self.sensorAuthoritative(myqid):
+            account.scheduler.start_burst()
+        return self.commandAccepted(myqid, device, COMMAND_OPEN, wait_task, last_update)
 
-            try:
-                wait_task = await device.close(wait_for_state=False)
-            except MyQError as err:
-                self.logger.error(f"Error trying to close '{device.name}': {err}")
-                return
+    async def pymyq_close(self, myqid):
+        account = self.accountFor(myqid)
+        api = await self.get_myq_api(account)
+        if not api:
+            return
 
-            if not await wait_task:
-                self.logger.warning(f"Failed to close '{device.name}'.")
-            self.needsUpdate = True
+        device = api.devices[myqid]
+        await self.pending_commands.settled(myqid)
+        if not device.close_allowed:
+            self.command_logger.warning(f"Closing of '{device.name}' is not allowed.")
             return
 
-    async def pymyq_turnon(self, myqid):
-        async with ClientSession() as web_session:
-            try:
-                api = await login(self.pluginPrefs['myqLogin'], self.pluginPrefs['myqPassword'], web_session)
-            except MyQError as err:
-                self.logger.warning(f"Error logging into MyQ server: {err}")
-                return
+        if device.state == STATE_CLOSED:
+            self.command_logger.info(f"'{device.name}' is already closed.")
+            return
 
-            device = api.devices[myqid]
-            try:
-                wait_task = await device.turnon(wait_for_state=False)
-            except MyQError as err:
-                self.logger.error(f"Error trying to turn on '{device.name}': {err}")
-                return
+        account.scheduler.budget.consume(force=True)
+        last_update = device.device_json["state"].get("last_update")
+        try:
+            with account.metrics.timer("command"):
+                wait_task = await account.policy.call(device.close, False, timeout=None)
+        except Exception as err:
+            self.command_logger.error(f"Error trying to close '{device.name}': {err}")
+            return
+
+        if not self.sensorAuthoritative(myqid):
+            account.scheduler.start_burst()
+        return self.commandAccepted(myqid, device, COMMAND_CLOSE, wait_task, last_update)
 
-            if not await wait_task:
-                self.logger.warning(f"Failed to turn on '{device.name}'.")
-            self.needsUpdate = True
+    async def pymyq_turnon(self, myqid):
+        account = self.accountFor(myqid)
+        api = await self.get_myq_api(account)
+        if not api:
             return
 
-    async def pymyq_turnoff(self, myqid):
-        async with ClientSession() as web_session:
-            try:
-                api = await login(self.pluginPrefs['myqLogin'], self.pluginPrefs['myqPassword'], web_session)
-            except MyQError as err:
-                self.logger.warning(f"Error logging into MyQ server: {err}")
-                return
+        device = api.devices[myqid]
+        await self.pending_commands.settled(myqid)
+        account.scheduler.budget.consume(force=True)
+        last_update = device.device_json["state"].get("last_update")
+        try:
+            with account.metrics.timer("command"):
+                wait_task = await account.policy.call(device.turnon, False, timeout=None)
+        except Exception as err:
+            self.command_logger.error(f"Error trying to turn on '{device.name}': {err}")
+            return
 
-            device = api.devices[myqid]
-            try:
-                wait_task = await device.turnoff(wait_for_state=False)
-            except MyQError as err:
-                self.logger.error(f"Error trying to turn off '{device.name}': {err}")
-                return
+        account.scheduler.start_burst()
+        return self.commandAccepted(myqid, device, COMMAND_ON, wait_task, last_update)
 
-            if not await wait_task:
-                self.logger.warning(f"Failed to turn off '{device.name}'.")
-            self.needsUpdate = True
+    async def pymyq_turnoff(self, myqid):
+        account = self.accountFor(myqid)
+        api = await self.get_myq_api(account)
+        if not api:
             return
+
+        device = api.devices[myqid]
+        await self.pending_commands.settled(myqid)
+        account.scheduler.budget.consume(force=True)
+        last_update = device.device_json["state"].get("last_update")
+        try:
+            with account.metrics.timer("command"):
+                wait_task = await account.policy.call(device.turnoff, False, timeout=None)
+        except Exception as err:
+            self.command_logger.error(f"Error trying to turn off '{device.name}': {err}")
+            return
+
+        account.scheduler.start_burst()
+        return self.commandAccepted(myqid, device, COMMAND_OFF, wait_task, last_update)
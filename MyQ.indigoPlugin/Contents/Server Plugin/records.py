@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import os
+import json
+import time
+from collections import deque
+
+TRANSITION_HISTORY = 20     # state transitions kept per device
+
+
+################################################################################
+class DeviceRecord:
+    """
+    What the plugin keeps about one MyQ device: only the fields it acts on, plus a short ring buffer of
+    recent state transitions as (time, old state, new state).
+    """
+    __slots__ = ("serial", "family", "name", "state", "online", "last_update", "account", "transitions")
+
+    def __init__(self, serial, family, account):
+        self.serial = serial
+        self.family = family
+        self.account = account
+        self.name = serial
+        self.state = None
+        self.online = None
+        self.last_update = None
+        self.transitions = deque(maxlen=TRANSITION_HISTORY)
+
+    def update(self, device_json, now=None):
+        # Returns True if the door or lamp state changed
+        state_json = device_json.get("state", {})
+        self.name = device_json.get("name", self.name)
+        self.online = state_json.get("online", self.online)
+        self.last_update = state_json.get("last_update", self.last_update)
+        state = state_json.get("door_state" if self.family == "garagedoor" else "lamp_state", self.state)
+        if state == self.state:
+            return False
+        if self.state is not None:
+            self.transitions.append((now or time.time(), self.state, state))
+        self.state = state
+        return True
+
+    def as_json(self):
+        # Enough of the MyQ device JSON to merge a partial pushed update into
+        state_key = "door_state" if self.family == "garagedoor" else "lamp_state"
+        return {
+            "serial_number": self.serial,
+            "device_family": self.family,
+            "name": self.name,
+            "state": {state_key: self.state, "online": self.online, "last_update": self.last_update},
+        }
+
+    def summary(self):
+        return f"{self.name:30} {self.serial:20} {self.family:12} {str(self.state):12} " \
+               f"{'online' if self.online else 'offline':8} {self.last_update}"
+
+
+################################################################################
+class DeviceCache:
+    """
+    DeviceRecords for the MyQ devices seen in each account's most recent poll.  Devices an account no longer
+    reports are evicted.  The records can be saved to disk and loaded at the next startup, so the plugin knows
+    its devices before the first cloud poll.
+    """
+
+    def __init__(self):
+        self.records = {}       # MyQ serial number -> DeviceRecord
+        self.dirty = False      # changed since the last save
+
+    def __contains__(self, serial):
+        return serial in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, serial):
+        return self.records.get(serial)
+
+    def update(self, device_json, account=None):
+        serial = device_json["serial_number"]
+        record = self.records.get(serial)
+        if record is None:
+            record = self.records[serial] = DeviceRecord(serial, device_json["device_family"], account)
+            self.dirty = True
+        elif account is not None and account != record.account:
+            record.account = account
+            self.dirty = True
+        name = record.name
+        if record.update(device_json) or record.name != name:
+            self.dirty = True
+        return record
+
+    def evict(self, account, seen):
+        # Drop this account's devices that aren't in `seen`, returns the serials dropped
+        stale = [serial for serial, record in self.records.items() if record.account == account and serial not in seen]
+        for serial in stale:
+            del self.records[serial]
+        if stale:
+            self.dirty = True
+        return stale
+
+    def save(self, path):
+        data = [{"serial": r.serial, "family": r.family, "account": r.account, "name": r.name, "state": r.state,
+                 "online": r.online, "last_update": r.last_update} for r in self.records.values()]
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": 1, "saved": time.time(), "devices": data}, f)
+        os.replace(temp_path, path)
+        self.dirty = False
+
+    def load(self, path):
+        # Returns the number of devices loaded.  Raises OSError or ValueError if the file is missing or unreadable.
+        with open(path, "r") as f:
+            data = json.load(f)
+        for item in data.get("devices", []):
+            record = DeviceRecord(item["serial"], item["family"], item.get("account"))
+            record.name = item.get("name") or item["serial"]
+            record.state = item.get("state")
+            record.online = item.get("online")
+            record.last_update = item.get("last_update")
+            self.records[record.serial] = record
+        self.dirty = False
+        return len(self.records)
+
+    def report(self):
+        lines = [f"{'name':30} {'serial':20} {'family':12} {'state':12} {'online':8} last update"]
+        for record in sorted(self.records.values(), key=lambda r: r.name):
+            lines.append(record.summary())
+        return "\n".join(lines)
+
+    def transitions_report(self):
+        lines = []
+        for record in sorted(self.records.values(), key=lambda r: r.name):
+            lines.append(f"{record.name} ({record.serial}): {len(record.transitions)} recent transitions")
+            for when, old, new in record.transitions:
+                lines.append(f"    {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}  {old} -> {new}")
+        return "\n".join(lines)
@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+import random
+import asyncio
+import logging
+import weakref
+
+from aiohttp import ClientError
+from pymyq.errors import MyQError, InvalidCredentialsError, AuthenticationError
+
+CALL_TIMEOUT = 60.0         # seconds for any one cloud call, pymyq's own retries included
+RETRY_BASE = 2.0            # first retry waits up to this long...
+RETRY_MAX = 30.0            # ...doubling each time, up to this
+BREAKER_THRESHOLD = 5       # consecutive failed calls that open the breaker
+PROBE_MIN = 60.0            # first probe this long after the breaker opens...
+PROBE_MAX = 1800.0          # ...doubling after each failed probe, up to this
+CREDENTIALS_PROBE = 3600.0  # bad credentials won't fix themselves, and retrying them risks an account lockout
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+# How a failed call is handled
+ERROR_TRANSIENT = "transient"       # network trouble, timeouts, cloud errors: retry with backoff
+ERROR_AUTH = "auth"                 # token rejected: start a new session, then retry
+ERROR_CREDENTIALS = "credentials"   # login refused: don't retry, open the breaker
+ERROR_FATAL = "fatal"               # anything else is a bug, don't retry
+
+
+# Tasks the plugin has cancelled itself.  Task.cancelling() does this from Python 3.11, Indigo 2022 runs 3.10.
+_cancelled_tasks = weakref.WeakSet()
+
+
+def cancel(task):
+    # Cancel a task, remembering that we asked it to stop
+    _cancelled_tasks.add(task)
+    task.cancel()
+
+
+def cancel_requested():
+    # True in a task cancelled with cancel().  A CancelledError anywhere else came from a task it was waiting on.
+    task = asyncio.current_task()
+    return task is not None and task in _cancelled_tasks
+
+
+def classify(err):
+    if isinstance(err, InvalidCredentialsError):
+        return ERROR_CREDENTIALS
+    if isinstance(err, AuthenticationError):
+        return ERROR_AUTH
+    if isinstance(err, (MyQError, ClientError, asyncio.TimeoutError, OSError)):
+        return ERROR_TRANSIENT
+    return ERROR_FATAL
+
+
+class CloudUnavailable(Exception):
+    """Raised instead of calling the cloud while the breaker is open."""
+    pass
+
+
+class CallCancelled(Exception):
+    """Raised when something inside a cloud call was cancelled, but the caller wasn't."""
+    pass
+
+
+################################################################################
+class CircuitBreaker:
+    """
+    Stops calls to an account's cloud after BREAKER_THRESHOLD consecutive failures.  While open, one probe call is
+    let through every probe interval, and the interval doubles after each failed probe.  A successful call closes
+    it again.  on_change(state) is called on every transition.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.probe_interval = PROBE_MIN
+        self.next_probe = 0.0
+        self.opened_at = None
+        self.last_error = ""
+
+    @property
+    def available(self):
+        return self.state == BREAKER_CLOSED
+
+    def allow(self, now=None):
+        if self.state == BREAKER_CLOSED:
+            return True
+        now = now or time.time()
+        if self.state == BREAKER_OPEN and now >= self.next_probe:
+            self._set_state(BREAKER_HALF_OPEN)
+            return True
+        return False        # open, or a probe is already in flight
+
+    def retry_in(self, now=None):
+        return max(0.0, self.next_probe - (now or time.time()))
+
+    def release(self):
+        # A probe was cancelled before it finished, let the next call probe instead
+        if self.state == BREAKER_HALF_OPEN:
+            self.state = BREAKER_OPEN
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_interval = PROBE_MIN
+        self.next_probe = 0.0
+        self.opened_at = None
+        if self.state != BREAKER_CLOSED:
+            self._set_state(BREAKER_CLOSED)
+
+    def record_failure(self, err, now=None, probe_interval=None):
+        now = now or time.time()
+        self.failures += 1
+        self.last_error = str(err) or err.__class__.__name__
+        if probe_interval:
+            self.probe_interval = probe_interval
+        elif self.state == BREAKER_HALF_OPEN:
+            self.probe_interval = min(self.probe_interval * 2, PROBE_MAX)
+        elif self.failures < BREAKER_THRESHOLD:
+            return
+        self.next_probe = now + random.uniform(0.9, 1.1) * self.probe_interval
+        if self.state != BREAKER_OPEN:
+            self.opened_at = self.opened_at or now
+            self._set_state(BREAKER_OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_change:
+            self.on_change(state)
+
+
+################################################################################
+class RetryPolicy:
+    """
+    Runs cloud calls with a timeout, retries by error class with jittered exponential backoff, and feeds the
+    outcome to the account's circuit breaker.  A call that exhausts its retries counts as one breaker failure.
+
+    Device state commands are called with attempts=1 and timeout=None: pymyq's command waits for the device's
+    previous command to be confirmed, and cancelling it would cancel pymyq's own confirmation task.
+    """
+
+    def __init__(self, breaker, reset_session=None, metrics=None):
+        self.logger = logging.getLogger("Plugin.RetryPolicy")
+        self.breaker = breaker
+        self.reset_session = reset_session      # async reset_session(), called after an authentication error
+        self.metrics = metrics                  # each retry is recorded as a "retry" sample of its backoff delay
+        self.retries = 0
+
+    async def call(self, func, *args, attempts=1, timeout=CALL_TIMEOUT):
+        # await func(*args).  Raises CloudUnavailable if the breaker is open, otherwise the last error.  timeout=None waits as long as it takes.
+        if not self.breaker.allow():
+            raise CloudUnavailable(f"MyQ cloud unavailable, next try in {self.breaker.retry_in():.0f} seconds")
+
+        for attempt in range(attempts):
+            try:
+                result = await asyncio.wait_for(func(*args), timeout)
+            except asyncio.CancelledError as err:
+                if cancel_requested():
+                    self.breaker.release()
+                    raise
+                # a task the call was waiting on was cancelled, not this one: that's a failed call
+                self.breaker.record_failure(err)
+                raise CallCancelled(f"{getattr(func, '__name__', func)} was cancelled") from err
+            except Exception as err:
+                kind = classify(err)
+                if kind == ERROR_AUTH and self.reset_session:
+                    await self.reset_session()
+                if kind == ERROR_CREDENTIALS:
+                    self.breaker.record_failure(err, probe_interval=CREDENTIALS_PROBE)
+                    raise
+                if kind == ERROR_FATAL or attempt == attempts - 1:
+                    self.breaker.record_failure(err)
+                    raise
+                delay = random.uniform(0.0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+                self.retries += 1
+                if self.metrics:
+                    self.metrics["retry"].record(delay, err)
+                self.logger.debug(f"RetryPolicy: {getattr(func, '__name__', func)} failed ({kind}: {err!r}), "
+                                  f"retry {attempt + 1} in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
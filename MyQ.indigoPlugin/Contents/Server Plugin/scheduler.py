@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+import random
+
+FAST_POLL_INTERVAL = 10.0       # pymyq ignores update requests closer together than this
+BURST_DURATION = 90.0           # fast polling continues this long after a command or a transitional state
+MAX_BURST_DURATION = 300.0      # a single burst never runs longer than this, even if the door stays in transition
+POLL_JITTER = 0.1               # +/- fraction applied to every interval
+
+REQUEST_BUDGET = 30             # cloud requests allowed...
+REQUEST_BUDGET_PERIOD = 600.0   # ...per this many seconds
+
+
+################################################################################
+class RequestBudget:
+    """
+    Token bucket shared by everything that talks to the MyQ cloud.
+    """
+
+    def __init__(self, capacity=REQUEST_BUDGET, period=REQUEST_BUDGET_PERIOD):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.denied = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def consume(self, now=None, force=False):
+        # Take one token.  Forced requests (user actions) always go through but still count against the budget.
+        now = now or time.time()
+        self._refill(now)
+        if self.tokens >= 1.0 or force:
+            self.tokens = max(self.tokens - 1.0, -self.capacity)
+            return True
+        self.denied += 1
+        return False
+
+    def wait_time(self, now=None):
+        now = now or time.time()
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+################################################################################
+class PollScheduler:
+    """
+    Decides when the next cloud poll should happen.
+
+    Idle polling runs at the user's statusFrequency.  A command, or a poll that finds a door in a transitional
+    state, starts a bounded burst of fast polls.  After the burst the interval backs off exponentially until it
+    is back to the idle interval.  Every interval gets random jitter, and every poll has to fit in the request budget.
+    While the update stream is connected there are no bursts, and polling is just an idle-interval safety net.
+    """
+
+    def __init__(self, idle_interval, budget=None):
+        self.idle_interval = idle_interval
+        self.budget = budget or RequestBudget()
+        self.burst_start = 0.0
+        self.burst_until = 0.0
+        self.backoff_interval = None
+        self.burst_capped = False       # set when a burst ran to MAX_BURST_DURATION, until the doors settle
+        self.push_active = False        # state changes are arriving on the update stream, poll only as a safety net
+        self.next_poll = time.time()
+
+    def set_idle_interval(self, idle_interval):
+        self.idle_interval = idle_interval
+        self.next_poll = min(self.next_poll, time.time() + self._jitter(idle_interval))
+
+    def set_push_active(self, push_active, now=None):
+        now = now or time.time()
+        self.push_active = push_active
+        if push_active:
+            self.burst_until = 0.0
+            self.backoff_interval = None
+        else:
+            # pushes may have been missed while the stream was going down, catch up soon
+            self.next_poll = min(self.next_poll, now + FAST_POLL_INTERVAL)
+
+    def defer(self, seconds, now=None):
+        # Hold off the next poll for at least this long
+        now = now or time.time()
+        self.next_poll = max(self.next_poll, now + seconds)
+
+    def in_burst(self, now=None):
+        return (now or time.time()) < self.burst_until
+
+    def start_burst(self, now=None):
+        if self.push_active:
+            return
+        now = now or time.time()
+        if not self.in_burst(now):
+            self.burst_start = now
+            self.burst_capped = False
+        self.burst_until = min(now + BURST_DURATION, self.burst_start + MAX_BURST_DURATION)
+        if self.burst_until < now + BURST_DURATION:
+            self.burst_capped = True
+        self.backoff_interval = None
+        self.next_poll = min(self.next_poll, now + FAST_POLL_INTERVAL)
+
+    def poll_due(self, now=None):
+        # True if it's time to poll and the budget allows it.  If the budget is spent, push the poll back.
+        now = now or time.time()
+        if now < self.next_poll:
+            return False
+        if self.budget.consume(now):
+            return True
+        self.next_poll = now + self.budget.wait_time(now)
+        return False
+
+    def poll_done(self, transitional, now=None):
+        # Schedule the next poll after one completes.  transitional is True if any door was opening, closing, etc.
+        now = now or time.time()
+        if self.push_active:
+            self.next_poll = now + self._jitter(self.idle_interval)
+            return self.idle_interval
+
+        if not transitional:
+            self.burst_capped = False
+        elif self.in_burst(now) or not self.burst_capped:
+            # a door stuck in transition gets one capped burst, not an endless series of them
+            self.start_burst(now)
+
+        if self.in_burst(now):
+            interval = FAST_POLL_INTERVAL
+        elif self.burst_until and self.backoff_interval is None:
+            self.backoff_interval = FAST_POLL_INTERVAL * 2
+            interval = self.backoff_interval
+        elif self.backoff_interval is not None and self.backoff_interval < self.idle_interval:
+            self.backoff_interval *= 2
+            interval = min(self.backoff_interval, self.idle_interval)
+        else:
+            self.burst_until = 0.0
+            self.backoff_interval = None
+            interval = self.idle_interval
+
+        self.next_poll = now + self._jitter(interval)
+        return interval
+
+    @staticmethod
+    def _jitter(interval):
+        return interval * random.uniform(1.0 - POLL_JITTER, 1.0 + POLL_JITTER)
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import json
+import random
+import asyncio
+import logging
+
+from aiohttp import ClientSession, ClientError, WSMsgType
+
+RECONNECT_MIN = 1.0         # seconds before the first reconnect attempt
+RECONNECT_MAX = 300.0       # reconnect backoff never grows past this
+HEARTBEAT = 30.0            # websocket ping interval, a dead connection is noticed within about this long
+
+
+################################################################################
+class StreamClient:
+    """
+    Persistent websocket connection that receives pushed device state changes.
+
+    Each text message is JSON: either one device object shaped like an entry in the MyQ device list
+    ({"serial_number": ..., "state": {...}}), or {"items": [device, ...]}.  A device object can carry only
+    the state fields that changed.  Every device object is passed to on_device(device_json).
+
+    on_connected(bool) is called whenever the stream comes up or goes down, so the caller can relax or resume
+    polling.  When the connection drops it's retried with jittered exponential backoff.
+
+    The stream has its own aiohttp session and its own credential, sent as a bearer token if one is set.  Only
+    wss:// URLs are accepted, so the credential never travels in clear text.
+    """
+
+    def __init__(self, url, token, on_device, on_connected, ssl=True):
+        if not url.startswith("wss://"):
+            raise ValueError(f"update stream URL must start with wss://, not {url!r}")
+        self.logger = logging.getLogger("Plugin.Poll.Stream")
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.ssl = ssl                      # True verifies the server against the system's certificates, or an SSLContext
+        self.on_device = on_device
+        self.on_connected = on_connected
+        self.connected = False
+        self.reconnects = 0
+        self.messages = 0
+
+    async def run(self):
+        async with ClientSession(headers=self.headers) as web_session:
+            await self._run(web_session)
+
+    async def _run(self, web_session):
+        delay = RECONNECT_MIN
+        while True:
+            try:
+                async with web_session.ws_connect(self.url, heartbeat=HEARTBEAT, ssl=self.ssl) as ws:
+                    self.logger.debug(f"StreamClient: connected to {self.url}")
+                    self._set_connected(True)
+                    delay = RECONNECT_MIN
+                    async for msg in ws:
+                        if msg.type == WSMsgType.TEXT:
+                            self._handle_message(msg.data)
+                        elif msg.type in (WSMsgType.CLOSED, WSMsgType.ERROR):
+                            break
+                self.logger.debug("StreamClient: connection closed by server")
+            except asyncio.CancelledError:
+                self._set_connected(False)
+                raise
+            except (ClientError, OSError, asyncio.TimeoutError) as err:
+                self.logger.debug(f"StreamClient: connection error: {err!r}")
+            except Exception as err:
+                self.logger.warning(f"MyQ update stream error: {err!r}")
+
+            self._set_connected(False)
+            self.reconnects += 1
+            wait = random.uniform(delay / 2, delay)
+            self.logger.debug(f"StreamClient: reconnecting in {wait:.1f} seconds")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    def _set_connected(self, connected):
+        if connected != self.connected:
+            self.connected = connected
+            self.on_connected(connected)
+
+    def _handle_message(self, data):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            self.logger.debug(f"StreamClient: ignoring non-JSON message: {data[:100]}")
+            return
+        if not isinstance(message, dict):
+            return
+        self.messages += 1
+        for device_json in message.get("items", [message]):
+            if isinstance(device_json, dict) and device_json.get("serial_number"):
+                self.on_device(device_json)
@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import contextvars
+
+# Subsystems with their own log level.  Each logs to "Plugin.<Name>", and the helper classes log to children of
+# those, so they follow their subsystem's level.
+SUBSYSTEMS = ("poll", "commands", "sensors", "triggers")
+
+TRACE_MAX_BYTES = 5 * 1024 * 1024   # the trace rotates to trace.1.jsonl at this size
+
+# Correlation id of the poll or command being handled.  asyncio tasks copy it when they're created, so work a poll
+# or command starts carries its id without passing it along.
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+
+def subsystem_logger(subsystem):
+    return logging.getLogger(f"Plugin.{subsystem.capitalize()}")
+
+
+def set_log_levels(logger, handlers, level, subsystem_levels):
+    """
+    Gate logging at the loggers, so messages below every configured level are dropped before they are formatted.
+    subsystem_levels maps a subsystem to its level, or to 0 to follow `level`.  The handlers pass the most
+    detailed level configured.
+    """
+    lowest = min([level] + [sub_level for sub_level in subsystem_levels.values() if sub_level])
+    logger.setLevel(level)
+    for subsystem in SUBSYSTEMS:
+        subsystem_logger(subsystem).setLevel(subsystem_levels.get(subsystem) or logging.NOTSET)
+    for handler in handlers:
+        handler.setLevel(lowest)
+
+
+################################################################################
+class Tracer:
+    """
+    Optional JSON-lines trace of polls, commands, sensor changes and triggers, one object per line:
+
+        {"t": 1700000000.123, "id": "cmd-12", "sub": "commands", "event": "accepted", "serial": "GDO...", "ms": 412.0}
+
+    Every event carries the correlation id of the poll or command it belongs to, so one door command can be
+    followed from the action to its confirmation.  While disabled, event() returns without building anything.
+    Methods can be called from any thread.
+    """
+
+    def __init__(self, path=None, max_bytes=TRACE_MAX_BYTES):
+        self.logger = logging.getLogger("Plugin.Tracer")
+        self.path = None
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.ids = itertools.count(1)
+        self.set_path(path)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def set_path(self, path):
+        # Start tracing to path, or stop tracing with None
+        with self.lock:
+            self._close_file()
+            self.path = path
+
+    def start(self, kind):
+        # New correlation id for a poll or command, in effect for the current task and the tasks it creates
+        cid = f"{kind}-{next(self.ids)}"
+        correlation_id.set(cid)
+        return cid
+
+    def event(self, subsystem, event, **fields):
+        if self.path is None:
+            return
+        record = {"t": round(time.time(), 3), "id": correlation_id.get(), "sub": subsystem, "event": event}
+        record.update(fields)
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.file = open(self.path, "a")
+                self.file.write(line)
+                self.file.flush()
+                if self.file.tell() >= self.max_bytes:
+                    self._close_file()
+                    root, ext = os.path.splitext(self.path)
+                    os.replace(self.path, f"{root}.1{ext}")
+            except OSError as err:
+                self.logger.warning(f"Unable to write trace to {self.path}, tracing stopped: {err}")
+                self._close_file()
+                self.path = None
+
+    def _close_file(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        with self.lock:
+            self._close_file()
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+import time
+import logging
+import threading
+
+EVENT_DOOR_SYNC = "myqDoorSync"             # door state and linked sensor disagree
+EVENT_DOOR_OPEN = "doorOpenTooLong"         # door has been open longer than N minutes
+EVENT_CLOUD_DOWN = "cloudUnavailable"
+EVENT_CLOUD_UP = "cloudAvailable"
+
+# Trigger prop that picks which opener or account a trigger watches.  A blank value matches any.
+FILTER_PROPS = {
+    EVENT_DOOR_SYNC: "door",
+    EVENT_DOOR_OPEN: "door",
+    EVENT_CLOUD_DOWN: "account",
+    EVENT_CLOUD_UP: "account",
+}
+
+DEFAULT_OPEN_MINUTES = 10.0
+
+
+def trigger_delay(trigger):
+    # Seconds a condition has to hold before this trigger fires
+    try:
+        if trigger.pluginTypeId == EVENT_DOOR_OPEN:
+            return float(trigger.pluginProps.get("minutes") or DEFAULT_OPEN_MINUTES) * 60.0
+        return float(trigger.pluginProps.get("delay") or 0)
+    except ValueError:
+        return 0.0
+
+
+################################################################################
+class TriggerEngine:
+    """
+    Plugin triggers, indexed by event type and by the opener (or account) each one watches.
+
+    Door events are conditions: set_condition(event, opener id, active) is called whenever the condition is
+    evaluated, as often as the caller likes.  When a condition becomes active, each matching trigger fires
+    after its delay, from a timer rather than a later poll.  It fires once per episode, and the condition has to
+    clear before it can fire again.  Other events are one-shot: fire(event, key) runs matching triggers now.
+
+    Methods can be called from any thread.  call_later(delay, callback) must be thread-safe.
+    """
+
+    def __init__(self, execute, call_later):
+        self.logger = logging.getLogger("Plugin.Triggers.Engine")
+        self.execute = execute          # execute(trigger)
+        self.call_later = call_later
+        self.lock = threading.Lock()
+        self.triggers = {}              # trigger id -> trigger
+        self.index = {}                 # (event, filter value) -> set of trigger ids, "" matches any
+        self.active = {}                # (event, key) -> time the condition became active
+        self.armed = {}                 # (trigger id, key) -> timer token, a trigger waiting out its delay
+        self.fired = set()              # (trigger id, key) already fired for the current episode
+        self.fired_count = 0
+        self._token = 0
+
+    def register(self, trigger):
+        event = trigger.pluginTypeId
+        value = str(trigger.pluginProps.get(FILTER_PROPS.get(event, ""), "") or "")
+        with self.lock:
+            self.triggers[trigger.id] = trigger
+            self.index.setdefault((event, value), set()).add(trigger.id)
+            # a condition that is already active counts from when it started
+            for (active_event, key), since in self.active.items():
+                if active_event == event and value in ("", key):
+                    self._arm(trigger, key, trigger_delay(trigger) - (time.time() - since))
+
+    def unregister(self, trigger_id):
+        with self.lock:
+            trigger = self.triggers.pop(trigger_id, None)
+            if not trigger:
+                return
+            for ids in self.index.values():
+                ids.discard(trigger_id)
+            self.armed = {k: v for k, v in self.armed.items() if k[0] != trigger_id}
+            self.fired = {k for k in self.fired if k[0] != trigger_id}
+
+    def matching(self, event, key):
+        ids = self.index.get((event, ""), set()) | self.index.get((event, str(key)), set())
+        return [self.triggers[trigger_id] for trigger_id in sorted(ids)]
+
+    def set_condition(self, event, key, active):
+        key = str(key)
+        with self.lock:
+            was_active = (event, key) in self.active
+            if active == was_active:
+                return
+            if active:
+                self.active[(event, key)] = time.time()
+                for trigger in self.matching(event, key):
+                    self._arm(trigger, key, trigger_delay(trigger))
+            else:
+                del self.active[(event, key)]
+                for trigger in self.matching(event, key):
+                    self.armed.pop((trigger.id, key), None)
+                    self.fired.discard((trigger.id, key))
+
+    def fire(self, event, key):
+        with self.lock:
+            triggers = self.matching(event, key)
+        for trigger in triggers:
+            self._execute(trigger)
+
+    def _arm(self, trigger, key, delay):
+        # called with the lock held
+        if (trigger.id, key) in self.fired or (trigger.id, key) in self.armed:
+            return
+        if delay <= 0:
+            self.fired.add((trigger.id, key))
+            self._execute(trigger)
+            return
+        self._token += 1
+        token = self.armed[(trigger.id, key)] = self._token
+        self.call_later(delay, lambda: self._expired(trigger.id, key, token))
+
+    def _expired(self, trigger_id, key, token):
+        with self.lock:
+            if self.armed.get((trigger_id, key)) != token:
+                return      # the condition cleared, or the trigger went away, while the timer ran
+            del self.armed[(trigger_id, key)]
+            self.fired.add((trigger_id, key))
+            trigger = self.triggers[trigger_id]
+        self._execute(trigger)
+
+    def _execute(self, trigger):
+        self.fired_count += 1
+        self.logger.debug("TriggerEngine: executing %s (%s)", trigger.name, trigger.id)
+        try:
+            self.execute(trigger)
+        except Exception as err:
+            self.logger.error(f"Error executing trigger {trigger.name}: {err!r}")
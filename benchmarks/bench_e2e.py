@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+"""
+End-to-end benchmarks: the plugin, real pymyq and a local MockMyQCloud, with Indigo replaced by fake_indigo.
+
+    poll        one full refresh (device list fetch plus fan-out to Indigo devices) at several device counts
+    command     open N doors at once, time until the cloud accepts each command and until each is confirmed
+    updated     deviceUpdated() calls per second, for devices unrelated to the plugin and for linked sensors
+    stream      update stream over wss:// with a self-signed certificate: push latency to the Indigo device, then the
+                mock drops the socket and the catch-up poll has to be scheduled (a failed check exits with status 1)
+
+Results are compared against a saved baseline and any metric worse than --threshold is reported as a regression
+(exit status 1).
+
+    python3 benchmarks/bench_e2e.py [--sizes 1,10,100,500] [--latency 0.02] [--error-rate 0] [--save-baseline]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import fake_indigo
+import harness
+from mock_myq import MockMyQCloud, self_signed_ssl
+from scheduler import FAST_POLL_INTERVAL
+from stream import StreamClient
+
+DEFAULT_BASELINE = os.path.join(harness.BENCH_DIR, "baseline.json")
+
+
+def make_plugin(openers, lamps):
+    plugin = harness.make_plugin()
+    plugin.logger.setLevel(logging.WARNING)
+    harness.add_devices(plugin, openers=openers, lamps=lamps)
+    return plugin
+
+
+def bench_poll(size, repeat, latency, error_rate):
+    cloud = harness.start_cloud(openers=size, lamps=size, latency=latency, error_rate=error_rate, seed=1)
+    plugin = make_plugin(size, size)
+    account = harness.default_account(plugin)
+    harness.use_cloud(plugin, cloud)
+    harness.run(plugin.pymyq_update(account))     # logs in and writes every state, time the steady state
+    api = account.session.api
+
+    fake_indigo.reset_counters()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        harness.unthrottle(api)
+        harness.run(plugin.pymyq_update(account))
+    elapsed = (time.perf_counter() - start) / repeat
+    ipc = fake_indigo.ipc_calls / repeat
+
+    harness.run(account.session.close())
+    harness.run(cloud.stop())
+    harness.clear_devices(plugin)
+    return elapsed, ipc
+
+
+def bench_command(doors, latency, travel_time):
+    cloud = harness.start_cloud(openers=doors, lamps=0, latency=latency, travel_time=travel_time, seed=1)
+    plugin = make_plugin(doors, 0)
+    account = harness.default_account(plugin)
+    harness.use_cloud(plugin, cloud)
+    harness.run(plugin.pymyq_update(account))
+
+    finished = {}
+    done = asyncio.Event()
+    finish = plugin.pending_commands.finish
+
+    def on_finish(pending, confirmed):
+        finish(pending, confirmed)
+        finished[pending.serial] = (time.perf_counter(), confirmed)
+        if len(finished) == doors:
+            done.set()
+
+    plugin.pending_commands.finish = on_finish
+
+    async def open_all():
+        start = time.perf_counter()
+        for serial in cloud.devices:
+            plugin.command_dispatcher.submit(serial, "open")
+        await done.wait()
+        return start
+
+    start = harness.run(open_all())
+    confirm = max(t for t, _ in finished.values()) - start
+    confirmed = sum(1 for _, result in finished.values() if result)
+    accept = account.metrics["command"].summary()
+
+    harness.run(account.session.close())
+    harness.run(cloud.stop())
+    harness.clear_devices(plugin)
+    return accept["p50"], accept["p95"], confirm, confirmed
+
+
+def bench_updated(openers, others, repeat):
+    plugin = make_plugin(openers, 0)
+    sensors = []
+    for i, opener in enumerate(list(plugin.myqOpeners.values())):
+        sensor = fake_indigo.SensorDevice(5000 + i, f"Sensor {i}", "sensor", states={"onOffState": False})
+        fake_indigo.devices[sensor.id] = sensor
+        opener.pluginProps["use_sensor"] = True
+        opener.pluginProps["sensor"] = str(sensor.id)
+        plugin.indexSensor(opener)
+        sensors.append(sensor)
+    unrelated = [fake_indigo.Device(9000 + i, f"Other {i}", "other", states={"onOffState": False})
+                 for i in range(others)]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for dev in unrelated:
+            plugin.deviceUpdated(dev, dev)
+    unrelated_rate = repeat * others / (time.perf_counter() - start)
+
+    def flipped(dev, state):
+        return fake_indigo.SensorDevice(dev.id, dev.name, dev.deviceTypeId, states={"onOffState": state})
+
+    closed = [flipped(sensor, False) for sensor in sensors]
+    opened = [flipped(sensor, True) for sensor in sensors]
+    start = time.perf_counter()
+    for n in range(repeat):
+        before, after = (closed, opened) if n % 2 == 0 else (opened, closed)
+        for orig, new in zip(before, after):
+            plugin.deviceUpdated(orig, new)
+    sensor_rate = repeat * openers / (time.perf_counter() - start)
+
+    harness.clear_devices(plugin)
+    return unrelated_rate, sensor_rate
+
+
+def bench_stream(pushes):
+    server_ssl, client_ssl = self_signed_ssl()
+    cloud = MockMyQCloud(openers=1, lamps=0, seed=1)
+    harness.run(cloud.start(ssl_context=server_ssl))
+    plugin = make_plugin(1, 0)
+    serial = next(iter(cloud.devices))
+    plugin.applyDeviceJson(cloud.devices[serial])     # known from a poll, so pushes can carry only the state
+    dev = plugin.indigoDevice(serial)
+    scheduler = harness.default_account(plugin).scheduler
+    client = StreamClient(cloud.stream_url, "", plugin.streamDeviceUpdate, plugin.streamConnected, ssl=client_ssl)
+
+    async def until(condition, timeout=10.0):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                raise AssertionError("timed out")
+            await asyncio.sleep(0.001)
+
+    async def scenario():
+        task = asyncio.ensure_future(client.run())
+        try:
+            await until(lambda: client.connected)
+            checks = {"push active while connected": scheduler.push_active}
+            latencies = []
+            for n in range(pushes):
+                state = "open" if n % 2 == 0 else "closed"
+                start = time.perf_counter()
+                cloud.set_state(serial, state)
+                await until(lambda: dev.states.get("doorStatus") == state)
+                latencies.append(time.perf_counter() - start)
+
+            scheduler.next_poll = time.time() + 3600.0
+            await cloud.drop_streams()
+            await until(lambda: not client.connected)
+            catch_up = scheduler.next_poll - time.time()
+            checks["polling resumes when the stream drops"] = not scheduler.push_active
+            checks["catch-up poll scheduled"] = catch_up <= FAST_POLL_INTERVAL
+            await until(lambda: client.connected)
+            checks["reconnects"] = client.reconnects == 1
+            return sorted(latencies), catch_up, checks
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    latencies, catch_up, checks = harness.run(scenario())
+    harness.run(cloud.stop())
+    harness.clear_devices(plugin)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)], catch_up, checks
+
+
+########################################
+# Regression reporting
+########################################
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'metric':32} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:32} {'-':>12} {result['value']:>12.3f} {'new':>9}")
+            continue
+        if base["value"]:
+            change = (result["value"] - base["value"]) / base["value"]
+        else:
+            change = 0.0 if result["value"] == base["value"] else float("inf")
+        worse = change > threshold if result["better"] == "lower" else change < -threshold
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:32} {base['value']:>12.3f} {result['value']:>12.3f} {change:>+9.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,100,500", help="openers (and as many lamps) per poll benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="mock cloud mean latency per request, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock API requests failing with 503")
+    parser.add_argument("--doors", type=int, default=10, help="doors opened at once in the command benchmark")
+    parser.add_argument("--travel-time", type=float, default=1.0, help="seconds a mock door takes to open")
+    parser.add_argument("--skip-command", action="store_true", help="skip the command benchmark (about 10 seconds)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="fractional change reported as a regression")
+    args = parser.parse_args()
+
+    results = {}
+
+    def result(name, value, unit, better="lower"):
+        results[name] = {"value": value, "unit": unit, "better": better}
+
+    print(f"{'devices':>8} {'ms/poll':>10} {'ipc/poll':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        seconds, ipc = bench_poll(size, args.repeat, args.latency, args.error_rate)
+        print(f"{size * 2:>8} {seconds * 1000:>10.2f} {ipc:>10.0f}")
+        result(f"poll_{size * 2}_ms", seconds * 1000, "ms")
+        result(f"poll_{size * 2}_ipc", ipc, "calls")
+
+    if not args.skip_command:
+        p50, p95, confirm, confirmed = bench_command(args.doors, args.latency, args.travel_time)
+        print(f"\ncommand accept p50 {p50:.1f} ms, p95 {p95:.1f} ms; {confirmed}/{args.doors} doors confirmed "
+              f"in {confirm:.1f} s")
+        result("command_accept_p95_ms", p95, "ms")
+        result("command_confirm_all_s", confirm, "s")
+
+    unrelated_rate, sensor_rate = bench_updated(openers=50, others=1000, repeat=args.repeat * 10)
+    print(f"\ndeviceUpdated: {unrelated_rate:,.0f}/s unrelated devices, {sensor_rate:,.0f}/s linked sensor changes")
+    result("updated_unrelated_per_s", unrelated_rate, "calls/s", better="higher")
+    result("updated_sensor_per_s", sensor_rate, "calls/s", better="higher")
+
+    p50, p95, catch_up, checks = bench_stream(pushes=args.repeat * 5)
+    print(f"\nstream push to Indigo p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms; "
+          f"catch-up poll {catch_up:.1f} s after the stream dropped")
+    failed = [name for name, ok in checks.items() if not ok]
+    for name in failed:
+        print(f"stream check failed: {name}")
+    result("stream_push_p95_ms", p95 * 1000, "ms")
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        print(f"\n{len(regressions)} regression(s)" + (f": {', '.join(regressions)}" if regressions else ""))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nbaseline saved to {args.baseline}")
+
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+"""
+Poll fan-out cost as the number of MyQ devices grows.
+
+Times Plugin.pymyq_update() against an in-process fake pymyq API with N openers and N lamps, all with
+matching Indigo devices, and reports steady-state wall time and Indigo IPC calls per poll.
+
+    python3 benchmarks/bench_poll.py [--sizes 1,10,50,100,250,500] [--repeat 20]
+"""
+
+import argparse
+import logging
+
+import harness
+
+
+def bench_poll(size, repeat):
+    plugin = harness.make_plugin()
+    plugin.logger.setLevel(logging.INFO)
+    serials = harness.add_devices(plugin, openers=size, lamps=size)
+    account = harness.default_account(plugin)
+    account.session = harness.FakeMyQSession(harness.FakeMyQAPI(serials))
+    harness.run(plugin.pymyq_update(account))     # first poll writes every state, time the steady state
+    seconds, ipc = harness.time_coro(lambda: plugin.pymyq_update(account), repeat)
+    harness.clear_devices(plugin)
+    return seconds, ipc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,50,100,250,500")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'devices':>8} {'ms/poll':>10} {'us/device':>10} {'ipc/poll':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        seconds, ipc = bench_poll(size, args.repeat)
+        print(f"{size * 2:>8} {seconds * 1000:>10.3f} {seconds * 1e6 / (size * 2):>10.2f} {ipc:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
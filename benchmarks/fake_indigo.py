@@ -0,0 +1,171 @@
+"""
+Minimal stand-in for the Indigo server's `indigo` module, enough to load and drive plugin.py outside of Indigo.
+
+Every call that would be an IPC round-trip to the Indigo server is counted in `ipc_calls`, so benchmarks
+can report server load as well as wall time.
+"""
+
+import logging
+import tempfile
+import time
+
+ipc_calls = 0
+
+
+def _ipc():
+    global ipc_calls
+    ipc_calls += 1
+
+
+def reset_counters():
+    global ipc_calls
+    ipc_calls = 0
+
+
+class Dict(dict):
+    pass
+
+
+class List(list):
+    pass
+
+
+class _Server:
+    def __init__(self):
+        self.install_folder = tempfile.mkdtemp(prefix="indigo-")
+
+    def getInstallFolderPath(self):
+        return self.install_folder
+
+    def log(self, *args, **kwargs):
+        pass
+
+
+server = _Server()
+
+
+class kDeviceAction:
+    Unlock = "Unlock"
+    Lock = "Lock"
+    TurnOn = "TurnOn"
+    TurnOff = "TurnOff"
+    RequestStatus = "RequestStatus"
+
+
+class Device:
+    def __init__(self, dev_id, name, deviceTypeId, address="", props=None, states=None):
+        self.id = dev_id
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.address = address
+        self.pluginId = "com.flyingdiver.indigoplugin.myq"
+        self.pluginProps = Dict(props or {})
+        self.pluginProps.setdefault("address", address)
+        self.states = dict(states or {})
+        self.enabled = True
+        self.errorState = ""
+
+    @property
+    def onState(self):
+        return self.states.get("onOffState")
+
+    def updateStateOnServer(self, key, value, **kwargs):
+        _ipc()
+        self.states[key] = value
+
+    def updateStatesOnServer(self, state_list):
+        _ipc()
+        self.errorState = ""
+        for state in state_list:
+            self.states[state["key"]] = state["value"]
+
+    def updateStateImageOnServer(self, image):
+        _ipc()
+
+    def setErrorStateOnServer(self, error):
+        _ipc()
+        self.errorState = error or ""
+
+    def replacePluginPropsOnServer(self, props):
+        _ipc()
+        self.pluginProps = Dict(props)
+        self.address = props.get("address", self.address)
+
+    def stateListOrDisplayStateIdChanged(self):
+        _ipc()
+
+
+class SensorDevice(Device):
+    pass
+
+
+class MultiIODevice(Device):
+    pass
+
+
+class _Devices(dict):
+
+    def iter(self, filter=""):
+        for dev in list(self.values()):
+            if filter.startswith("self.") and dev.deviceTypeId != filter[5:]:
+                continue
+            _ipc()
+            yield dev
+
+    def __getitem__(self, key):
+        _ipc()
+        return dict.__getitem__(self, key)
+
+    def subscribeToChanges(self):
+        pass
+
+
+devices = _Devices()
+
+
+class _Triggers(dict):
+
+    def __init__(self):
+        super().__init__()
+        self.executed = []
+
+    def execute(self, trigger):
+        _ipc()
+        self.executed.append((time.time(), trigger.id))
+
+
+trigger = _Triggers()
+
+
+class Trigger:
+    def __init__(self, trigger_id, name, pluginTypeId, props=None):
+        self.id = trigger_id
+        self.name = name
+        self.pluginTypeId = pluginTypeId
+        self.pluginProps = Dict(props or {})
+
+
+class PluginBase:
+
+    class StopThread(Exception):
+        pass
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger("Plugin")
+        self.logger.setLevel(logging.DEBUG)
+        self.indigo_log_handler = logging.NullHandler()
+        self.plugin_file_handler = logging.NullHandler()
+        self.logger.addHandler(self.indigo_log_handler)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    def deviceDeleted(self, dev):
+        pass
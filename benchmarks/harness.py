@@ -0,0 +1,188 @@
+"""
+Load the MyQ plugin against fake_indigo and populate it with synthetic devices, optionally talking to a
+local MockMyQCloud through the real pymyq library.
+"""
+
+import builtins
+import importlib.util
+import json
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(BENCH_DIR), "MyQ.indigoPlugin", "Contents", "Server Plugin")
+PLUGIN_ID = "com.flyingdiver.indigoplugin.myq"
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, PLUGIN_DIR)
+
+import fake_indigo  # noqa: E402
+from mock_myq import MockMyQCloud, redirect_pymyq, TOKEN_LIFETIME  # noqa: E402
+
+sys.modules["indigo"] = fake_indigo
+builtins.indigo = fake_indigo     # Indigo injects the module into plugin.py's globals
+
+
+def load_plugin_module():
+    spec = importlib.util.spec_from_file_location("plugin", os.path.join(PLUGIN_DIR, "plugin.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+plugin_module = load_plugin_module()
+
+
+def make_plugin(prefs=None):
+    plugin_prefs = {
+        "myqLogin": "bench@example.com",
+        "myqPassword": "password",
+        "statusFrequency": "10",
+        "logLevel": "20",
+    }
+    plugin_prefs.update(prefs or {})
+    plugin = plugin_module.Plugin(PLUGIN_ID, "MyQ", "bench", fake_indigo.Dict(plugin_prefs))
+    # startup() isn't called, so there's no plugin loop to run background refreshes; benchmarks drive polls directly
+    plugin.request_refresh = lambda key=None: None
+    return plugin
+
+
+def add_devices(plugin, openers, lamps, first_id=1000):
+    """Create Indigo opener and lamp devices, start them, and return the MyQ serials used."""
+    serials = []
+    dev_id = first_id
+    for i in range(openers):
+        serial = f"GDO{i:05d}"
+        dev = fake_indigo.Device(dev_id, f"Door {i}", "myqOpener", serial, props={"devVersCount": 2})
+        fake_indigo.devices[dev_id] = dev
+        plugin.deviceStartComm(dev)
+        serials.append((serial, "garagedoor"))
+        dev_id += 1
+    for i in range(lamps):
+        serial = f"LMP{i:05d}"
+        dev = fake_indigo.Device(dev_id, f"Lamp {i}", "myqLight", serial)
+        fake_indigo.devices[dev_id] = dev
+        plugin.deviceStartComm(dev)
+        serials.append((serial, "lamp"))
+        dev_id += 1
+    return serials
+
+
+def default_account(plugin):
+    return plugin.accounts[plugin_module.DEFAULT_ACCOUNT]
+
+
+def clear_devices(plugin):
+    for dev in list(fake_indigo.devices.values()):
+        plugin.deviceStopComm(dev)
+    fake_indigo.devices.clear()
+
+
+########################################
+# In-process stand-in for pymyq, used where the network layer isn't what is being measured
+########################################
+
+class FakeMyQDevice:
+    def __init__(self, serial, family, state):
+        self.state_key = "door_state" if family == "garagedoor" else "lamp_state"
+        self.device_json = {
+            "serial_number": serial,
+            "device_family": family,
+            "name": serial,
+            "state": {self.state_key: state, "online": True},
+        }
+        self.open_allowed = self.close_allowed = True
+
+    @property
+    def name(self):
+        return self.device_json["name"]
+
+    @property
+    def state(self):
+        return self.device_json["state"][self.state_key]
+
+
+class FakeMyQAPI:
+    def __init__(self, serials):
+        self.devices = {}
+        for serial, family in serials:
+            self.devices[serial] = FakeMyQDevice(serial, family, "closed" if family == "garagedoor" else "off")
+        self._security_token = ("Bearer bench", datetime.utcnow() + timedelta(hours=1), datetime.now())
+
+    async def update_device_info(self):
+        pass
+
+
+class FakeMyQSession:
+    def __init__(self, api):
+        self.api = api
+        self.username = "bench@example.com"
+        self.password = "password"
+
+    def ready(self):
+        return True
+
+    async def get_api(self):
+        return self.api
+
+    async def reset(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+########################################
+# Real pymyq against the local mock cloud
+########################################
+
+def start_cloud(**kwargs):
+    """Start a MockMyQCloud on the harness loop and point pymyq at it."""
+    cloud = MockMyQCloud(**kwargs)
+    redirect_pymyq(run(cloud.start()))
+    return cloud
+
+
+def use_cloud(plugin, cloud, oauth=False):
+    """
+    Give the plugin a fresh MyQSession for the mock cloud.  By default it resumes with a saved token issued by the
+    mock; pymyq's OAuth form login sends a multi-line Cookie header that aiohttp 3.9+ refuses, so oauth=True only
+    works with the older aiohttp Indigo bundles.
+    """
+    from myq_session import MyQSession
+    token_file = os.path.join(fake_indigo.server.getInstallFolderPath(), f"token-{id(plugin)}.json")
+    if not oauth:
+        refresh_at = datetime.utcnow() + timedelta(seconds=TOKEN_LIFETIME / 2)
+        with open(token_file, "w") as f:
+            json.dump({"username": cloud.username, "token": f"Bearer {cloud.issue_token()}",
+                       "refresh_at": refresh_at.isoformat(), "last_refresh": datetime.now().isoformat()}, f)
+    account = default_account(plugin)
+    account.session = MyQSession(cloud.username, cloud.password, token_file=token_file, metrics=account.metrics)
+    return account.session
+
+
+def unthrottle(api):
+    # pymyq ignores refreshes within 10 seconds (API) or 5 seconds (account) of the last, reset for back-to-back polls
+    api.last_state_update = None
+    for account in api.accounts.values():
+        account.last_state_update = None
+
+
+_loop = asyncio.new_event_loop()
+
+
+def run(coro):
+    return _loop.run_until_complete(coro)
+
+
+def time_coro(coro_func, repeat):
+    """Average seconds per call and Indigo IPC calls per call for an async plugin method."""
+    fake_indigo.reset_counters()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run(coro_func())
+    elapsed = time.perf_counter() - start
+    return elapsed / repeat, fake_indigo.ipc_calls / repeat
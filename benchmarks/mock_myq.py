@@ -0,0 +1,287 @@
+"""
+Local stand-in for the MyQ cloud, speaking the endpoints pymyq 3.1.6 uses.
+
+    identity   GET/POST /identity/connect/authorize, GET /identity/connect/authorize/callback,
+               POST /identity/connect/token               (OAuth login form and token exchange)
+    accounts   GET  /accounts/api/v6.0/accounts
+    devices    GET  /devices/api/v5.2/Accounts/{account_id}/Devices
+    commands   PUT  /gdo/api/v5.2/Accounts/{account_id}/door_openers/{serial}/{open|close}
+               PUT  /lamp/api/v5.2/Accounts/{account_id}/lamps/{serial}/{on|off}
+    stream     GET  /stream                               (websocket, pushes device JSON on every state change)
+
+Latency, error rate and device counts are configurable.  redirect_pymyq() points pymyq's hard-coded cloud URLs at
+a running instance.  With an ssl_context the mock serves https:// and wss://, self_signed_ssl() makes one for
+127.0.0.1 along with a client context that trusts it.
+
+    python3 benchmarks/mock_myq.py --openers 20 --lamps 5 --latency 0.05     # run standalone
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import ssl
+import subprocess
+import tempfile
+from datetime import datetime
+
+from aiohttp import web, WSMsgType
+
+ACCOUNT_ID = "mock-account-1"
+USERNAME = "bench@example.com"
+PASSWORD = "password"
+TOKEN_LIFETIME = 1200
+
+
+class MockMyQCloud:
+
+    def __init__(self, openers=1, lamps=1, latency=0.0, error_rate=0.0, travel_time=1.0,
+                 username=USERNAME, password=PASSWORD, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.travel_time = travel_time
+        self.username = username
+        self.password = password
+        self.random = random.Random(seed)
+        self.tokens = set()
+        self.codes = set()
+        self.devices = {}
+        self.sockets = set()
+        self.requests = {}          # endpoint -> count
+        self.errors_injected = 0
+        self.runner = None
+        self.url = None
+        self.stream_url = None
+        for i in range(openers):
+            self.add_device(f"GDO{i:05d}", "garagedoor", f"Door {i}", "closed")
+        for i in range(lamps):
+            self.add_device(f"LMP{i:05d}", "lamp", f"Lamp {i}", "off")
+
+    def add_device(self, serial, family, name, state):
+        state_key = "door_state" if family == "garagedoor" else "lamp_state"
+        self.devices[serial] = {
+            "serial_number": serial,
+            "device_family": family,
+            "device_platform": "myq",
+            "device_type": "wifigaragedooropener" if family == "garagedoor" else "lamp",
+            "name": name,
+            "account_id": ACCOUNT_ID,
+            "state": {
+                state_key: state,
+                "online": True,
+                "is_unattended_open_allowed": True,
+                "is_unattended_close_allowed": True,
+                "last_update": self._now(),
+            },
+        }
+
+    def set_state(self, serial, state):
+        device = self.devices[serial]
+        state_key = "door_state" if device["device_family"] == "garagedoor" else "lamp_state"
+        device["state"][state_key] = state
+        device["state"]["last_update"] = self._now()
+        self._push(device)
+
+    @staticmethod
+    def _now():
+        return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+    ########################################
+    # Server lifecycle
+    ########################################
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/identity/connect/authorize", self.authorize_page)
+        app.router.add_post("/identity/connect/authorize", self.authorize_login)
+        app.router.add_get("/identity/connect/authorize/callback", self.authorize_callback)
+        app.router.add_post("/identity/connect/token", self.token)
+        app.router.add_get("/accounts/api/v6.0/accounts", self.accounts)
+        app.router.add_get("/devices/api/v5.2/Accounts/{account_id}/Devices", self.device_list)
+        app.router.add_put("/gdo/api/v5.2/Accounts/{account_id}/door_openers/{serial}/{command}", self.door_command)
+        app.router.add_put("/lamp/api/v5.2/Accounts/{account_id}/lamps/{serial}/{command}", self.lamp_command)
+        app.router.add_get("/stream", self.stream)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0, ssl_context=None):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port, ssl_context=ssl_context)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        secure = "s" if ssl_context else ""
+        self.url = f"http{secure}://{host}:{port}"
+        self.stream_url = f"ws{secure}://{host}:{port}/stream"
+        return self.url
+
+    async def stop(self):
+        await self.drop_streams()
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def drop_streams(self):
+        # Close every update stream connection, as a cloud restart would
+        for ws in list(self.sockets):
+            await ws.close()
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(self.latency * 0.5, self.latency * 1.5))
+        if not request.path.startswith("/identity") and request.path != "/stream":
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors_injected += 1
+                raise web.HTTPServiceUnavailable()
+            if request.headers.get("Authorization", "").split(" ")[-1] not in self.tokens:
+                raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    ########################################
+    # OAuth login
+    ########################################
+
+    async def authorize_page(self, request):
+        html = """<html><body>
+            <form method="post" action="">
+                <input type="hidden" name="__RequestVerificationToken" value="mock-verification-token"/>
+                <input type="email" name="Email"/>
+                <input type="password" name="Password"/>
+                <input type="submit" name="Submit" value="Sign In"/>
+            </form>
+        </body></html>"""
+        return web.Response(text=html, content_type="text/html")
+
+    async def authorize_login(self, request):
+        form = await request.post()
+        if form.get("Email") != self.username or form.get("Password") != self.password:
+            return web.Response(text="Invalid login", content_type="text/html")
+        response = web.HTTPFound("/connect/authorize/callback")
+        response.set_cookie("idsrv", secrets.token_hex(8))
+        response.set_cookie("idsrv.session", secrets.token_hex(8))
+        return response
+
+    async def authorize_callback(self, request):
+        code = secrets.token_hex(16)
+        self.codes.add(code)
+        return web.HTTPFound(f"/ios?code={code}&scope=MyQ_Residential%20offline_access")
+
+    async def token(self, request):
+        form = await request.post()
+        code = form.get("code")
+        if code not in self.codes:
+            raise web.HTTPBadRequest(text="invalid_grant")
+        self.codes.discard(code)
+        return web.json_response({"access_token": self.issue_token(), "token_type": "Bearer",
+                                  "expires_in": TOKEN_LIFETIME})
+
+    def issue_token(self):
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+        return token
+
+    ########################################
+    # Devices and commands
+    ########################################
+
+    async def accounts(self, request):
+        return web.json_response({"accounts": [{"id": ACCOUNT_ID, "name": "Mock Home"}]})
+
+    async def device_list(self, request):
+        if request.match_info["account_id"] != ACCOUNT_ID:
+            raise web.HTTPNotFound()
+        items = [json.loads(json.dumps(device)) for device in self.devices.values()]
+        return web.json_response({"count": len(items), "items": items})
+
+    async def door_command(self, request):
+        serial = request.match_info["serial"]
+        command = request.match_info["command"]
+        if serial not in self.devices or command not in ("open", "close"):
+            raise web.HTTPNotFound()
+        moving, final = ("opening", "open") if command == "open" else ("closing", "closed")
+        self.set_state(serial, moving)
+        asyncio.get_running_loop().call_later(self.travel_time, self.set_state, serial, final)
+        return web.Response(status=202)
+
+    async def lamp_command(self, request):
+        serial = request.match_info["serial"]
+        command = request.match_info["command"]
+        if serial not in self.devices or command not in ("on", "off"):
+            raise web.HTTPNotFound()
+        self.set_state(serial, command)
+        return web.Response(status=202)
+
+    ########################################
+    # Push stream
+    ########################################
+
+    async def stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.sockets.discard(ws)
+        return ws
+
+    def _push(self, device):
+        message = json.dumps({"serial_number": device["serial_number"], "state": device["state"]})
+        for ws in list(self.sockets):
+            asyncio.ensure_future(ws.send_str(message))
+
+
+def self_signed_ssl(host="127.0.0.1"):
+    """(server SSLContext, client SSLContext) for a throwaway self-signed certificate, made with the openssl CLI."""
+    directory = tempfile.mkdtemp(prefix="mock-myq-")
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-keyout", key,
+                    "-out", cert, "-subj", f"/CN={host}", "-addext", f"subjectAltName=IP:{host}"],
+                   check=True, capture_output=True)
+    server = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server.load_cert_chain(cert, key)
+    client = ssl.create_default_context(cafile=cert)
+    return server, client
+
+
+def redirect_pymyq(base_url):
+    """Point pymyq's hard-coded cloud endpoints at a MockMyQCloud."""
+    import pymyq.api
+    import pymyq.account
+    import pymyq.garagedoor
+    import pymyq.lamp
+
+    pymyq.api.OAUTH_BASE_URI = f"{base_url}/identity"
+    pymyq.api.OAUTH_AUTHORIZE_URI = f"{base_url}/identity/connect/authorize"
+    pymyq.api.OAUTH_TOKEN_URI = f"{base_url}/identity/connect/token"
+    pymyq.api.ACCOUNTS_ENDPOINT = f"{base_url}/accounts/api/v6.0/accounts"
+    pymyq.account.DEVICES_ENDPOINT = f"{base_url}/devices/api/v5.2/Accounts/{{account_id}}/Devices"
+    pymyq.garagedoor.COMMAND_URI = f"{base_url}/gdo/api/v5.2/Accounts/{{account_id}}/door_openers/{{device_serial}}/{{command}}"
+    pymyq.lamp.COMMAND_URI = f"{base_url}/lamp/api/v5.2/Accounts/{{account_id}}/lamps/{{device_serial}}/{{command}}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--openers", type=int, default=2)
+    parser.add_argument("--lamps", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API requests that fail with 503")
+    parser.add_argument("--travel-time", type=float, default=5.0, help="seconds a door takes to open or close")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    async def serve():
+        cloud = MockMyQCloud(args.openers, args.lamps, args.latency, args.error_rate, args.travel_time)
+        print(f"Mock MyQ cloud on {await cloud.start(port=args.port)}, login {cloud.username} / {cloud.password}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
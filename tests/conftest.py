@@ -0,0 +1,33 @@
+"""
+The plugin's modules are imported directly from the Server Plugin folder, as benchmarks/harness.py does.
+Only plugin.py needs Indigo, and these tests don't import it.
+"""
+
+import os
+import sys
+
+import pytest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "MyQ.indigoPlugin", "Contents", "Server Plugin")
+sys.path.insert(0, PLUGIN_DIR)
+
+
+class Timers:
+    """call_later() that runs callbacks when the test says so."""
+
+    def __init__(self):
+        self.pending = []
+
+    def __call__(self, delay, callback):
+        self.pending.append((delay, callback))
+
+    def run(self):
+        pending, self.pending = self.pending, []
+        for _, callback in pending:
+            callback()
+
+
+@pytest.fixture
+def timers():
+    return Timers()
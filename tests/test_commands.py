@@ -0,0 +1,93 @@
+import asyncio
+
+from commands import CommandDispatcher, COMMAND_OPEN, COMMAND_CLOSE
+
+
+class Cloud:
+    """execute() for the dispatcher, holding each command until the test releases it."""
+
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def execute(self, serial, command):
+        self.sent.append((serial, command))
+        await self.release.wait()
+        self.release.clear()
+        return True
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def drain(dispatcher, cloud):
+    while dispatcher.workers:
+        cloud.release.set()
+        await asyncio.sleep(0)
+
+
+def test_newer_command_supersedes_queued_one():
+    async def main():
+        cloud, done = Cloud(), []
+        dispatcher = CommandDispatcher(cloud.execute, lambda *args: done.append(args))
+        dispatcher.submit("A", COMMAND_OPEN)
+        await asyncio.sleep(0)
+        dispatcher.submit("A", COMMAND_CLOSE)
+        dispatcher.submit("A", COMMAND_CLOSE)
+        dispatcher.submit("A", COMMAND_OPEN)
+        await drain(dispatcher, cloud)
+        return cloud, dispatcher, done
+
+    cloud, dispatcher, done = run(main())
+    # the close was dropped as a duplicate, then the open in flight made the queued close moot
+    assert cloud.sent == [("A", COMMAND_OPEN)]
+    assert dispatcher.duplicates == 2
+    assert dispatcher.superseded == 1
+    assert done == [("A", COMMAND_OPEN, True)]
+
+
+def test_queued_command_runs_after_in_flight_one():
+    async def main():
+        cloud, done = Cloud(), []
+        dispatcher = CommandDispatcher(cloud.execute, lambda *args: done.append(args))
+        dispatcher.submit("A", COMMAND_OPEN)
+        await asyncio.sleep(0)
+        dispatcher.submit("A", COMMAND_CLOSE)
+        assert dispatcher.busy("A")
+        await drain(dispatcher, cloud)
+        return cloud, dispatcher
+
+    cloud, dispatcher = run(main())
+    assert cloud.sent == [("A", COMMAND_OPEN), ("A", COMMAND_CLOSE)]
+    assert not dispatcher.busy("A")
+
+
+def test_devices_run_in_parallel():
+    async def main():
+        cloud = Cloud()
+        dispatcher = CommandDispatcher(cloud.execute, lambda *args: None)
+        dispatcher.submit("A", COMMAND_OPEN)
+        dispatcher.submit("B", COMMAND_OPEN)
+        await asyncio.sleep(0)
+        sent = list(cloud.sent)
+        await dispatcher.cancel_all()
+        return sent, dispatcher
+
+    sent, dispatcher = run(main())
+    assert sent == [("A", COMMAND_OPEN), ("B", COMMAND_OPEN)]
+    assert not dispatcher.workers and not dispatcher.active
+
+
+def test_failed_command_completes_with_none():
+    async def refuse(serial, command):
+        raise RuntimeError("refused")
+
+    async def main():
+        done = []
+        dispatcher = CommandDispatcher(refuse, lambda *args: done.append(args))
+        dispatcher.submit("A", COMMAND_CLOSE)
+        await asyncio.sleep(0)
+        return done
+
+    assert run(main()) == [("A", COMMAND_CLOSE, None)]
@@ -0,0 +1,68 @@
+from fusion import DoorFusion, PRECEDENCE_SENSOR, PRECEDENCE_CLOUD, DOOR_OPEN, DOOR_CLOSED
+
+DOOR = 101
+
+
+def make_fusion(timers, precedence=PRECEDENCE_SENSOR, debounce=2.0, sensor_open=False):
+    changes = []
+    fusion = DoorFusion(changes.append, timers)
+    fusion.configure(DOOR, precedence, debounce, sensor_open)
+    return fusion, changes
+
+
+def test_flapping_sensor_settles_into_one_change(timers):
+    fusion, changes = make_fusion(timers)
+    for sensor_open in (True, False, True, False, True):
+        fusion.sensor_update(DOOR, sensor_open)
+    timers.run()
+    assert changes == [DOOR]
+    assert fusion.sensor_changes == 1
+    assert fusion.sensor_events == 5
+    assert fusion.states(DOOR) == {"doorStatus": DOOR_OPEN, "onOffState": False}
+
+
+def test_flap_back_to_start_is_no_change(timers):
+    fusion, changes = make_fusion(timers)
+    fusion.sensor_update(DOOR, True)
+    fusion.sensor_update(DOOR, False)
+    timers.run()
+    assert changes == []
+    assert fusion.states(DOOR)["doorStatus"] == DOOR_CLOSED
+
+
+def test_zero_debounce_still_goes_through_call_later(timers):
+    fusion, changes = make_fusion(timers, debounce=0.0)
+    fusion.sensor_update(DOOR, True)
+    assert changes == []
+    assert [delay for delay, _ in timers.pending] == [0.0]
+    timers.run()
+    assert changes == [DOOR]
+
+
+def test_cloud_moving_state_stands_until_sensor_changes(timers):
+    fusion, changes = make_fusion(timers)
+    assert fusion.cloud_update(DOOR, "opening")["doorStatus"] == "opening"
+    fusion.sensor_update(DOOR, True)
+    timers.run()
+    assert fusion.states(DOOR)["doorStatus"] == DOOR_OPEN
+
+
+def test_cloud_precedence_and_mismatch(timers):
+    fusion, changes = make_fusion(timers, precedence=PRECEDENCE_CLOUD)
+    fusion.cloud_update(DOOR, DOOR_CLOSED)
+    fusion.sensor_update(DOOR, True)
+    timers.run()
+    assert fusion.states(DOOR) == {"doorStatus": DOOR_CLOSED, "onOffState": True}
+    assert fusion.mismatch(DOOR)
+    assert not fusion.authoritative(DOOR)
+
+    fusion.cloud_update(DOOR, "opening")
+    assert not fusion.mismatch(DOOR)        # a moving door can't disagree
+
+
+def test_removed_door_ignores_pending_settle(timers):
+    fusion, changes = make_fusion(timers)
+    fusion.sensor_update(DOOR, True)
+    fusion.remove(DOOR)
+    timers.run()
+    assert changes == []
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from history import DayTotals, KIND_STATE, KIND_COMMAND, STATE_CODES
+
+
+def local(hour, minute=0, day=15):
+    return datetime(2024, 3, day, hour, minute).timestamp()
+
+
+def test_day_totals_count_opens_and_open_time():
+    totals = DayTotals(local(8))
+    totals.add(local(8), KIND_STATE, STATE_CODES["open"], 0)
+    totals.add(local(8, 30), KIND_STATE, STATE_CODES["closed"], 0)
+    totals.add(local(9), KIND_COMMAND, 1, 12.5)
+    totals.add(local(9, 5), KIND_COMMAND, 1, -1.0)      # unconfirmed commands don't count
+    assert totals.opens == 1
+    assert totals.open_seconds == 30 * 60
+    assert totals.open_since is None
+    assert totals.last_confirm == 12.5
+
+
+def test_day_totals_roll_over_midnight_while_open():
+    totals = DayTotals(local(23))
+    totals.add(local(23), KIND_STATE, STATE_CODES["open"], 0)
+    totals.add(local(23, 30), KIND_COMMAND, 1, 5.0)
+
+    # the door is still open after midnight: today counts from midnight, with no opens yet
+    totals.add(local(0, 30, day=16), KIND_STATE, STATE_CODES["closed"], 0)
+    assert totals.day_start == local(0, day=16)
+    assert totals.opens == 0
+    assert totals.open_seconds == 30 * 60
+    assert totals.last_confirm is None
+
+
+def test_day_totals_roll_without_events():
+    totals = DayTotals(local(12))
+    totals.add(local(12), KIND_STATE, STATE_CODES["closed"], 0)
+    totals.roll(local(12, day=17))
+    assert totals.day_start == local(0, day=17)
+    assert totals.open_since is None
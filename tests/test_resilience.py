@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientError
+from pymyq.errors import InvalidCredentialsError
+
+import resilience
+from resilience import (CircuitBreaker, RetryPolicy, CloudUnavailable, CallCancelled, BREAKER_CLOSED, BREAKER_OPEN,
+                        BREAKER_HALF_OPEN, BREAKER_THRESHOLD, PROBE_MIN, PROBE_MAX, CREDENTIALS_PROBE)
+
+
+def open_breaker(breaker, now=1000.0):
+    for _ in range(BREAKER_THRESHOLD):
+        breaker.record_failure(ClientError("down"), now=now)
+
+
+def test_breaker_opens_after_threshold():
+    changes = []
+    breaker = CircuitBreaker(changes.append)
+    for _ in range(BREAKER_THRESHOLD - 1):
+        breaker.record_failure(ClientError("down"), now=1000.0)
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.retry_in(now=1000.0) == 0.0
+
+    breaker.record_failure(ClientError("down"), now=1000.0)
+    assert breaker.state == BREAKER_OPEN
+    assert changes == [BREAKER_OPEN]
+    assert 0.9 * PROBE_MIN <= breaker.retry_in(now=1000.0) <= 1.1 * PROBE_MIN
+    assert not breaker.allow(now=1001.0)
+
+
+def test_breaker_probe_and_backoff():
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+    probe_at = breaker.next_probe
+    assert breaker.allow(now=probe_at)
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow(now=probe_at)     # one probe at a time
+
+    breaker.record_failure(ClientError("still down"), now=probe_at)
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.probe_interval == 2 * PROBE_MIN
+
+    for _ in range(20):
+        breaker.allow(now=breaker.next_probe)
+        breaker.record_failure(ClientError("still down"), now=breaker.next_probe)
+    assert breaker.probe_interval == PROBE_MAX
+
+
+def test_breaker_release_lets_next_call_probe():
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+    assert breaker.allow(now=breaker.next_probe)
+    breaker.release()
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.allow(now=breaker.next_probe)
+
+
+def test_breaker_success_closes_and_clears_probe():
+    changes = []
+    breaker = CircuitBreaker(changes.append)
+    breaker.record_failure(InvalidCredentialsError("bad password"), now=1000.0, probe_interval=CREDENTIALS_PROBE)
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.retry_in(now=1000.0) > PROBE_MAX
+
+    # new credentials: the plugin closes the breaker so the next poll and command go through at once
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.available
+    assert breaker.retry_in(now=1000.0) == 0.0
+    assert breaker.allow(now=1000.0)
+    assert changes == [BREAKER_OPEN, BREAKER_CLOSED]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    async def sleep(delay):
+        pass
+    monkeypatch.setattr(resilience.asyncio, "sleep", sleep)
+
+
+def test_policy_retries_transient_errors(no_sleep):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ClientError("blip")
+        return "ok"
+
+    breaker = CircuitBreaker()
+    policy = RetryPolicy(breaker)
+    assert run(policy.call(flaky, attempts=3)) == "ok"
+    assert len(calls) == 3
+    assert policy.retries == 2
+    assert breaker.failures == 0
+
+
+def test_policy_does_not_retry_credentials(no_sleep):
+    calls = []
+
+    async def refused():
+        calls.append(1)
+        raise InvalidCredentialsError("bad password")
+
+    breaker = CircuitBreaker()
+    with pytest.raises(InvalidCredentialsError):
+        run(RetryPolicy(breaker).call(refused, attempts=3))
+    assert len(calls) == 1
+    assert breaker.state == BREAKER_OPEN
+    with pytest.raises(CloudUnavailable):
+        run(RetryPolicy(breaker).call(refused))
+
+
+def test_policy_inner_cancellation_is_a_failure():
+    async def waits_on_cancelled_task():
+        inner = asyncio.ensure_future(asyncio.sleep(10))
+        asyncio.get_running_loop().call_soon(inner.cancel)
+        await inner
+
+    breaker = CircuitBreaker()
+    with pytest.raises(CallCancelled):
+        run(RetryPolicy(breaker).call(waits_on_cancelled_task, timeout=None))
+    assert breaker.failures == 1
+
+
+def test_policy_our_cancellation_releases_probe():
+    breaker = CircuitBreaker()
+    open_breaker(breaker, now=0.0)
+    breaker.next_probe = 0.0
+
+    async def main():
+        task = asyncio.ensure_future(RetryPolicy(breaker).call(asyncio.sleep, 10))
+        await asyncio.sleep(0)
+        assert breaker.state == BREAKER_HALF_OPEN
+        resilience.cancel(task)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(main())
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.failures == BREAKER_THRESHOLD
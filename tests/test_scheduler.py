@@ -0,0 +1,93 @@
+import pytest
+
+import scheduler
+from scheduler import PollScheduler, RequestBudget, FAST_POLL_INTERVAL, BURST_DURATION, MAX_BURST_DURATION
+
+IDLE = 600.0
+
+
+@pytest.fixture(autouse=True)
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: 1.0)
+
+
+def test_idle_polls_at_idle_interval():
+    sched = PollScheduler(IDLE)
+    assert sched.poll_done(False, now=1000.0) == IDLE
+    assert sched.next_poll == 1000.0 + IDLE
+
+
+def test_burst_ends_then_backs_off_to_idle():
+    sched = PollScheduler(IDLE)
+    sched.start_burst(now=1000.0)
+    assert sched.next_poll <= 1000.0 + FAST_POLL_INTERVAL
+
+    now = 1000.0
+    while sched.in_burst(now):
+        assert sched.poll_done(False, now=now) == FAST_POLL_INTERVAL
+        now += FAST_POLL_INTERVAL
+    assert now == 1000.0 + BURST_DURATION
+
+    intervals = []
+    for _ in range(7):
+        intervals.append(sched.poll_done(False, now=now))
+        now += intervals[-1]
+    assert intervals == [20.0, 40.0, 80.0, 160.0, 320.0, IDLE, IDLE]
+    assert sched.burst_until == 0.0 and sched.backoff_interval is None
+
+
+def test_stuck_door_gets_one_capped_burst():
+    sched = PollScheduler(IDLE)
+    now = 1000.0
+    while now < 1000.0 + 2 * MAX_BURST_DURATION:
+        interval = sched.poll_done(True, now=now)
+        if interval != FAST_POLL_INTERVAL:
+            break
+        now += interval
+    assert now == 1000.0 + MAX_BURST_DURATION
+    assert sched.burst_capped
+    assert interval == 2 * FAST_POLL_INTERVAL     # backing off although the door is still in transition
+
+    # the door settles, so the next transition starts a fresh burst
+    now += interval
+    sched.poll_done(False, now=now)
+    assert not sched.burst_capped
+    assert sched.poll_done(True, now=now + 1) == FAST_POLL_INTERVAL
+
+
+def test_burst_extended_by_commands_is_capped():
+    sched = PollScheduler(IDLE)
+    for offset in range(0, int(MAX_BURST_DURATION), 30):
+        sched.start_burst(now=1000.0 + offset)
+    assert sched.burst_until == 1000.0 + MAX_BURST_DURATION
+    assert sched.burst_capped
+
+
+def test_push_active_suppresses_bursts():
+    sched = PollScheduler(IDLE)
+    sched.set_push_active(True, now=1000.0)
+    sched.start_burst(now=1000.0)
+    assert not sched.in_burst(1000.0)
+    assert sched.poll_done(True, now=1000.0) == IDLE
+    assert sched.next_poll == 1000.0 + IDLE
+
+
+def test_stream_drop_schedules_catch_up_poll():
+    sched = PollScheduler(IDLE)
+    sched.set_push_active(True, now=1000.0)
+    sched.poll_done(False, now=1000.0)
+    sched.set_push_active(False, now=1100.0)
+    assert sched.next_poll == 1100.0 + FAST_POLL_INTERVAL
+
+
+def test_spent_budget_defers_poll():
+    budget = RequestBudget(capacity=2, period=20.0)
+    sched = PollScheduler(IDLE, budget=budget)
+    sched.next_poll = 1000.0
+    budget.last_refill = 1000.0
+    assert sched.poll_due(now=1000.0)
+    assert sched.poll_due(now=1000.0)
+    assert not sched.poll_due(now=1000.0)
+    assert sched.next_poll == pytest.approx(1010.0)
+    assert budget.denied == 1
+    assert budget.consume(now=1000.0, force=True)    # user actions always go through
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+from triggers import TriggerEngine, EVENT_DOOR_OPEN, EVENT_DOOR_SYNC, EVENT_CLOUD_DOWN
+
+
+def make_trigger(trigger_id, event, **props):
+    return SimpleNamespace(id=trigger_id, name=f"trigger {trigger_id}", pluginTypeId=event, pluginProps=props)
+
+
+def make_engine(timers):
+    executed = []
+    engine = TriggerEngine(lambda trigger: executed.append(trigger.id), timers)
+    return engine, executed
+
+
+def test_condition_fires_once_per_episode(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_DOOR_SYNC, door="", delay="0"))
+
+    engine.set_condition(EVENT_DOOR_SYNC, 101, True)
+    engine.set_condition(EVENT_DOOR_SYNC, 101, True)
+    assert executed == [1]
+    assert not timers.pending
+
+    # clearing the condition re-arms the trigger for the next episode
+    engine.set_condition(EVENT_DOOR_SYNC, 101, False)
+    engine.set_condition(EVENT_DOOR_SYNC, 101, True)
+    assert executed == [1, 1]
+
+
+def test_delayed_trigger_fires_from_timer(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_DOOR_OPEN, door="101", minutes="5"))
+
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    assert executed == []
+    assert [delay for delay, _ in timers.pending] == [300.0]
+    timers.run()
+    assert executed == [1]
+
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    assert not timers.pending
+    assert executed == [1]
+
+
+def test_condition_cleared_before_delay_does_not_fire(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_DOOR_OPEN, door="", minutes="5"))
+
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    engine.set_condition(EVENT_DOOR_OPEN, 101, False)
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    timers.run()
+    assert executed == [1]      # only the second episode's timer counts
+
+
+def test_filter_by_door(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_DOOR_SYNC, door="101"))
+    engine.register(make_trigger(2, EVENT_DOOR_SYNC, door=""))
+
+    engine.set_condition(EVENT_DOOR_SYNC, 102, True)
+    assert executed == [2]
+    engine.set_condition(EVENT_DOOR_SYNC, 101, True)
+    assert executed == [2, 1, 2]
+
+
+def test_trigger_registered_during_episode_counts_from_start(timers):
+    engine, executed = make_engine(timers)
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    engine.register(make_trigger(1, EVENT_DOOR_OPEN, door="101", minutes="5"))
+    assert len(timers.pending) == 1
+    assert timers.pending[0][0] <= 300.0
+
+
+def test_unregister_cancels_armed_trigger(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_DOOR_OPEN, door="", minutes="5"))
+    engine.set_condition(EVENT_DOOR_OPEN, 101, True)
+    engine.unregister(1)
+    timers.run()
+    assert executed == []
+
+
+def test_one_shot_events_fire_every_time(timers):
+    engine, executed = make_engine(timers)
+    engine.register(make_trigger(1, EVENT_CLOUD_DOWN, account=""))
+    engine.fire(EVENT_CLOUD_DOWN, "me@example.com")
+    engine.fire(EVENT_CLOUD_DOWN, "me@example.com")
+    assert executed == [1, 1]